@@ -1,38 +1,48 @@
 #!/usr/bin/python3
-"""Canvas allows bulk assignment submission downloading, but does not provide any control over file naming. This
-script downloads an assignment's submissions and names them according to the submitter's Login ID (typically their
-institutional student number) or group name."""
+"""Download the submissions for every assignment in a course's selected assignment groups, naming them in the same way
+as submissiondownloader.py. All assignments are processed in a single run: submissions are listed course-wide where
+possible, the course roster, Login ID lookups and HTTP connections are shared, and every assignment's attachments are
+downloaded through one concurrent queue."""
 
 __author__ = 'Kameron Decker Harris'
 __copyright__ = 'Copyright (c) Kameron Decker Harris'
 __license__ = 'Apache 2.0'
-__version__ = '2024-12-19'  # ISO 8601 (YYYY-MM-DD)
+__version__ = '2026-10-19'  # ISO 8601 (YYYY-MM-DD)
 
 import argparse
 import concurrent.futures
-import csv
-import datetime
-import functools
 import json
 import os
 import re
 import sys
 import time
 
-import subprocess
-
-import openpyxl.utils
 import requests
 
-from canvashelpers import Args, Config, Utils
+import submissiondownloader
+from canvashelpers import Args, Config, TransferProgress, Utils
+
+DEFAULT_ASSIGNMENT_GROUPS = ['hw', 'labs', 'project']  # used if neither assignment groups nor a pattern are given
+PREPARE_MAX_WORKERS = 4  # assignments whose submissions are listed and filtered concurrently
 
 
 def get_args():
     parser = argparse.ArgumentParser()
     parser.add_argument('url', nargs=1,
-                        help='Please provide the URL of the coursse to download submissions for.')
+                        help='Please provide the URL of the course to download submissions for.')
+    parser.add_argument('--assignment-groups', nargs='+', default=None,
+                        help='The names of the assignment groups to download submissions for (case-insensitive). '
+                             'Default: %s, unless `--assignment-pattern` is set, in which case all groups are '
+                             'searched' % ' '.join(DEFAULT_ASSIGNMENT_GROUPS))
+    parser.add_argument('--assignment-pattern', default=None,
+                        help='Use this option to pass a (case-insensitive) regular expression pattern that will be '
+                             'used to select only assignments whose names match. For example, '
+                             '`^(?:Homework|Lab) \\d+$` will match assignments named `Homework 1` or `Lab 2`, but not '
+                             '`Homework 1 corrections`. If `--assignment-groups` is also set, assignments must match '
+                             'both')
     parser.add_argument('--working-directory', default=None,
-                        help='The location to use for output (which will be created if it does not exist). Default: the same directory as this script')
+                        help='The location to use for output (which will be created if it does not exist). Default: '
+                             'the same directory as this script')
     parser.add_argument('--speedgrader-file', default=None, choices=['XLSX', 'CSV'], type=str.upper,
                         help='Set this option to `XLSX` or `CSV` to create a file in the specified format containing '
                              'students\' (or groups\') names, IDs (both Canvas and institutional) and a link to the '
@@ -53,16 +63,40 @@ def get_args():
                              '`Matthew`, whereas `^123\\d{3}$` will match six–digit student numbers starting with '
                              '`123`. In groups mode this pattern is used to match *group names* only')
     parser.add_argument('--multiple-attachments', action='store_true',
-                        help='Use this option if there are multiple assignment attachments per student or group. This '
-                             'will change the behaviour of the script so that a new subfolder is created for each '
-                             'submission, named as the student\'s number or the group\'s name. The original filename '
-                             'will be used for each attachment that is downloaded. Without this option, any additional '
-                             'attachments will be ignored, and only the first file found will be downloaded')
+                        help='Accepted for compatibility with earlier versions of this script, but has no effect: each '
+                             'submission is always saved in its own subfolder, named as the student\'s number or the '
+                             'group\'s name, using the original filename of each attachment')
     return parser.parse_args()
 
+
+def get_downloader_arguments(assignment_id):
+    """Build the submissiondownloader.py arguments for one assignment. Each submission is always saved in its own
+    subfolder (i.e., `--multiple-attachments` mode)"""
+    downloader_arguments = [f"{args.url[0].rstrip('/')}/assignments/{assignment_id}",
+                            '--working-directory', OUTPUT_DIRECTORY, '--multiple-attachments']
+    if args.speedgrader_file:
+        downloader_arguments.extend(['--speedgrader-file', args.speedgrader_file])
+    if args.turnitin_pdf_session_id:
+        downloader_arguments.extend(['--turnitin-pdf-session-id', args.turnitin_pdf_session_id])
+    if args.submitter_pattern:
+        downloader_arguments.extend(['--submitter-pattern', args.submitter_pattern])
+    return submissiondownloader.get_args(downloader_arguments)
+
+
+def prepare_assignment(assignment):
+    """Create and prepare a SubmissionDownloader for one assignment (run concurrently for all selected assignments)"""
+    print(f"Preparing submissions for assignment {assignment['id']} ({assignment['name']})")
+    downloader = submissiondownloader.SubmissionDownloader(get_downloader_arguments(assignment['id']),
+                                                           assignment_details=assignment, session=session)
+    if downloader.prepare(submission_list_json=course_submissions.get(assignment['id'])):
+        return downloader
+    print(f"WARNING: skipping assignment {assignment['id']} - see above for details")
+    return None
+
+
 args = Args.interactive(get_args)
 COURSE_URL = Utils.course_url_to_api(args.url[0])
-COURSE_ID = Utils.get_assignment_id(COURSE_URL)  # used only for output directory
+COURSE_ID = Utils.get_course_id(COURSE_URL)  # used only for output directory
 print(f"Retrieving data for {COURSE_ID}")
 working_directory = os.path.dirname(
     os.path.realpath(__file__)) if args.working_directory is None else args.working_directory
@@ -76,38 +110,87 @@ if os.path.exists(OUTPUT_DIRECTORY):
 os.mkdir(OUTPUT_DIRECTORY)
 
 
-assignment_details_response = requests.get(COURSE_URL, headers=Utils.canvas_api_headers())
-if assignment_details_response.status_code != 200:
+course_details_response = requests.get(COURSE_URL, headers=Utils.canvas_api_headers())
+if course_details_response.status_code != 200:
     print('ERROR: unable to get course details - did you set a valid Canvas API token in %s?' % Config.FILE_PATH)
     sys.exit()
 
-#GROUPS = ["hw", "quiz", "exam"]
-GROUPS = ["hw", "labs", "project"]
+assignment_groups = args.assignment_groups
+if not assignment_groups and not args.assignment_pattern:
+    assignment_groups = DEFAULT_ASSIGNMENT_GROUPS
+assignment_matcher = re.compile(args.assignment_pattern, flags=re.IGNORECASE) if args.assignment_pattern else None
 
 ## Find assignment group ids to keep
-assignments_response = Utils.canvas_multi_page_request(f"{COURSE_URL}/assignment_groups", type_hint="assignments list")
-assignments_json = json.loads(assignments_response)
-group_ids = []
-for assignment in assignments_json:
-    if assignment['name'] in GROUPS:
-        group_ids.append(assignment['id'])
-        print(f"id: {assignment['id']}, name: {assignment['name']}")
-print(group_ids)
+group_ids = None  # None = all groups
+if assignment_groups:
+    selected_group_names = [group_name.lower() for group_name in assignment_groups]
+    assignments_response = Utils.canvas_multi_page_request(f"{COURSE_URL}/assignment_groups",
+                                                           type_hint="assignment groups list")
+    assignments_json = json.loads(assignments_response)
+    group_ids = []
+    for assignment in assignments_json:
+        if assignment['name'].lower() in selected_group_names:
+            group_ids.append(assignment['id'])
+            print(f"id: {assignment['id']}, name: {assignment['name']}")
+    print(group_ids)
+    if not group_ids:
+        print('ERROR: no assignment groups found matching', assignment_groups, '- aborting')
+        sys.exit()
 
-## Fetch all assignments and keep ones from selected group ids
+## Fetch all assignments and keep ones from selected group ids (their details are reused by each download)
 assignments_response = Utils.canvas_multi_page_request(f"{COURSE_URL}/assignments", type_hint="assignments list")
 assignments_json = json.loads(assignments_response)
-assignment_ids = []
-assignment_dict = []
+selected_assignments = []
 for assignment in assignments_json:
-    if assignment['assignment_group_id'] in group_ids:
-        assignment_ids.append(assignment['id'])
-        print(f"id: {assignment['id']}, name: {assignment['name']}")
-print(assignment_ids)
-
-## Now call the submission downloader for each assignment
-for assignment in assignment_ids:
-    ASSIGNMENT_URL = f"{args.url[0]}/assignments/{assignment}"
-    cmd_str = f"python3 submissiondownloader.py {ASSIGNMENT_URL} --working-directory {OUTPUT_DIRECTORY} --multiple-attachments"
-    print(f"running '{cmd_str}'")
-    os.system(cmd_str)
+    if group_ids is not None and assignment['assignment_group_id'] not in group_ids:
+        continue
+    if assignment_matcher and not assignment_matcher.search(assignment['name']):
+        continue
+    selected_assignments.append(assignment)
+    print(f"id: {assignment['id']}, name: {assignment['name']}")
+print([assignment['id'] for assignment in selected_assignments])
+if not selected_assignments:
+    print('ERROR: no assignments found matching the given assignment groups and/or pattern - aborting')
+    sys.exit()
+
+## Load the course roster once so that no assignment needs to look up students' Login IDs individually
+course_users_response = Utils.get_course_users(COURSE_URL)
+if course_users_response:
+    for user in json.loads(course_users_response):
+        if 'login_id' in user:
+            Utils.login_id_cache[user['id']] = user['login_id']
+    print(f"Loaded {len(Utils.login_id_cache)} student Login IDs from the course roster")
+
+## Individual assignments' submissions are all requested in one course-wide list; group assignments' are requested
+## separately, because only the per-assignment list includes students' groups
+individual_assignment_ids = [assignment['id'] for assignment in selected_assignments
+                             if not assignment['group_category_id']]
+course_submissions = {assignment_id: [] for assignment_id in individual_assignment_ids}
+if individual_assignment_ids:
+    course_submissions_response = Utils.get_course_submissions(COURSE_URL, individual_assignment_ids)
+    if not course_submissions_response:
+        print('ERROR: unable to retrieve course submission list - did you set a valid Canvas API token in %s?' %
+              Config.FILE_PATH)
+        sys.exit()
+    for submission in json.loads(course_submissions_response):
+        course_submissions[submission['assignment_id']].append(submission)
+    print(f"Loaded {sum(len(s) for s in course_submissions.values())} submissions for",
+          f"{len(individual_assignment_ids)} assignments")
+
+## Each assignment's submissions are filtered and its downloads planned concurrently, and its attachments join one
+## shared download queue as soon as it is ready, so a slow submission listing does not hold up the other assignments
+start_time = time.monotonic()
+session = requests.Session()
+with concurrent.futures.ThreadPoolExecutor(max_workers=PREPARE_MAX_WORKERS) as executor:
+    print(f"\nDownloading submissions for {len(selected_assignments)} assignments as each one is prepared")
+    downloaders = submissiondownloader.download_all(
+        [executor.submit(prepare_assignment, assignment) for assignment in selected_assignments])
+
+## Finally, summarise the time and data for each assignment so that the slowest can be identified
+assignment_names = {assignment['id']: assignment['name'] for assignment in selected_assignments}
+print(f"\nFinished downloading submissions for {len(downloaders)} of {len(selected_assignments)} assignments in",
+      f"{time.monotonic() - start_time:.1f}s - summary (slowest first):")
+for downloader in sorted(downloaders, key=lambda d: d.prepare_time + d.download_time, reverse=True):
+    print(f"\t{downloader.assignment_id} ({assignment_names[downloader.assignment_id]}):",
+          f"{downloader.downloaded_files} files ({TransferProgress.format_bytes(downloader.downloaded_bytes)});",
+          f"prepared in {downloader.prepare_time:.1f}s; downloads finished after {downloader.download_time:.1f}s")
@@ -5,19 +5,29 @@ The script also has an option to list direct media links, which is useful when e
 __author__ = 'Simon Robinson'
 __copyright__ = 'Copyright (c) 2024 Simon Robinson'
 __license__ = 'Apache 2.0'
-__version__ = '2024-04-16'  # ISO 8601 (YYYY-MM-DD)
+__version__ = '2026-10-19'  # ISO 8601 (YYYY-MM-DD)
 
 import argparse
+import concurrent.futures
 import json
 import mimetypes
 import os
 import re
 import sys
+import time
 import uuid
 
 import requests
 
-from canvashelpers import Args, Utils
+from canvashelpers import Args, TransferProgress, Utils
+
+UPLOAD_MAX_WORKERS = 4  # files that are uploaded concurrently
+UPLOAD_MAX_ATTEMPTS = 3  # attempts to upload each file before giving up
+UPLOAD_RETRY_DELAY = 2  # seconds before the first retry of a failed upload; doubles after each failure
+LICENSE_BATCH_SIZE = 100  # files whose licence (and publication state) are set in each `usage_rights` request
+FOLDER_MAX_WORKERS = 4  # Canvas folders that are created concurrently in `--recursive` mode
+SYNC_CACHE_FILE = '.bulkfileuploader-sync.json'  # saved in `--working-directory` (and never uploaded)
+SYNC_CACHE_FILES = (SYNC_CACHE_FILE, '%s.part' % SYNC_CACHE_FILE)  # including the temporary copy used when saving
 
 
 def get_args():
@@ -33,7 +43,12 @@ def get_args():
                              'used to filter and select only files whose names match. For example, `^.*\\.mp[34]$` '
                              'will match all mp3 or mp4 files in the directory, whereas `^Coursework` will match any '
                              'files whose names start with `Coursework`. If not provided, *all* files will be included '
-                             '(equivalent to `.*`)')
+                             '(equivalent to `.*`). In `--recursive` mode the pattern is matched against file names '
+                             'only (not their directories)')
+    parser.add_argument('--recursive', action='store_true',
+                        help='Upload the contents of `--working-directory` and all of its subdirectories, recreating '
+                             'the same directory structure within the given Canvas folder. Any Canvas folders that do '
+                             'not already exist are created automatically')
     parser.add_argument('--file-mime-type', default=None,
                         help='Canvas requires a hint about the MIME type of the attachment file you are uploading. The '
                              'script is able to guess the correct value in most cases, but if you are uploading files '
@@ -49,6 +64,17 @@ def get_args():
     parser.add_argument('--randomise-names', action='store_true',
                         help='If set, the script will rename the uploaded files with a random UUID (keeping the same '
                              'file extension)')
+    parser.add_argument('--sync', action='store_true',
+                        help='Only upload files that are new or have changed since they were last uploaded. The '
+                             'contents of the Canvas folder are listed, and any local file whose name and size match '
+                             'an existing Canvas file (and whose content has not changed since it was last uploaded by '
+                             'this script, according to a record of file hashes saved as `%s` in '
+                             '`--working-directory`) is skipped. Changed files are uploaded alongside the existing '
+                             'version (with Canvas renaming the new copy) unless `--overwrite` is also set. Cannot be '
+                             'combined with `--randomise-names`' % SYNC_CACHE_FILE)
+    parser.add_argument('--overwrite', action='store_true',
+                        help='Use this option *in addition* to `--sync` to replace the existing Canvas versions of '
+                             'changed files rather than keeping them')
     parser.add_argument('--get-media-ids', action='store_true',
                         help='When uploading media, Canvas converts files into its own formats before providing a '
                              'media ID (which is needed when using files in, e.g., Pages). This option instructs the '
@@ -59,8 +85,131 @@ def get_args():
     return parser.parse_args()
 
 
+def upload_file(file):
+    """Upload a single file, retrying up to UPLOAD_MAX_ATTEMPTS times if any step fails. Run concurrently for several
+    files at once. Returns the uploaded file's details, or None on failure"""
+    file_path = os.path.join(args.working_directory, file)
+    file_mime_type = args.file_mime_type or mimetypes.guess_type(file_path)[0]
+    _, file_extension = os.path.splitext(file_path)
+    file_name = '%s%s' % (uuid.uuid4().hex, file_extension) if args.randomise_names else os.path.basename(file)
+    folder_api_path = '%s/folders/%s/files' % (API_ROOT, folder_ids[os.path.dirname(file)])
+    print('Uploading', file, 'with MIME type', file_mime_type, 'and random name' if args.randomise_names else '',
+          file_name)
+
+    retry_delay = UPLOAD_RETRY_DELAY
+    for attempt in range(1, UPLOAD_MAX_ATTEMPTS + 1):
+        if attempt > 1:
+            print('\tRetrying upload of', file, '(attempt %d of %d) in %ds' % (attempt, UPLOAD_MAX_ATTEMPTS,
+                                                                             retry_delay))
+            time.sleep(retry_delay)
+            retry_delay *= 2
+
+        # we first need to request an upload URL, then send the actual data
+        submission_form_data = {
+            'name': file_name,
+            'content_type': file_mime_type
+        }
+        if args.sync:
+            submission_form_data['on_duplicate'] = 'overwrite' if args.overwrite else 'rename'
+        try:
+            file_upload_url_response = session.post(folder_api_path, data=submission_form_data,
+                                                    headers=Utils.canvas_api_headers())
+            if file_upload_url_response.status_code != 200:
+                print('\tERROR: unable to retrieve file upload URL for', file)
+                continue
+
+            file_upload_url_json = file_upload_url_response.json()
+            print('\tUploading', file, 'to', file_upload_url_json['upload_url'].split('?')[0], '[truncated]')
+            file_upload_response = Utils.upload_file(file_upload_url_json['upload_url'], submission_form_data,
+                                                     file_name, file_path, mime_type=file_mime_type, session=session,
+                                                     progress=upload_progress)
+        except requests.exceptions.RequestException as e:
+            print('\tERROR: unable to upload', file, '-', e)
+            continue
+
+        if file_upload_response.status_code != 201:  # note: 201 Created
+            print('\tERROR: unable to upload', file, '-', file_upload_response.text)
+            continue
+
+        file_upload_json = file_upload_response.json()
+        upload_progress.add(completed_files=1)
+        print('\tSuccessfully saved', file, 'as file', file_upload_json['id'], 'at',
+              '%s%s' % (args.url[0].split('/courses')[0], file_upload_json['preview_url'].split('?')[0]),
+              '- upload progress:', upload_progress.status())
+        return file_upload_json
+
+    print('\tERROR: unable to upload', file, 'after', UPLOAD_MAX_ATTEMPTS, 'attempts; skipping')
+    return None
+
+
+def get_sync_cache_entry(file, cached_entry):
+    """Return the sync cache entry (size, modification time and SHA-256 hash) for a local file, reusing the hash from
+    cached_entry if the file's size and modification time have not changed since it was calculated"""
+    file_stat = os.stat(os.path.join(args.working_directory, file))
+    if cached_entry and cached_entry['size'] == file_stat.st_size and cached_entry['mtime_ns'] == file_stat.st_mtime_ns:
+        return dict(cached_entry)
+    return {'size': file_stat.st_size, 'mtime_ns': file_stat.st_mtime_ns,
+            'sha256': Utils.get_file_sha256(os.path.join(args.working_directory, file))}
+
+
+def create_folder(directory, parent_folder_id):
+    """Create the Canvas folder for a local directory (relative to `--working-directory`) within its parent's folder.
+    Returns the new folder's ID, or None on failure"""
+    folder_creation_response = session.post('%s/folders/%s/folders' % (API_ROOT, parent_folder_id),
+                                            data={'name': os.path.basename(directory)},
+                                            headers=Utils.canvas_api_headers())
+    if folder_creation_response.status_code != 200:
+        print('\tERROR: unable to create folder for', directory, '-', folder_creation_response.text)
+        return None
+    print('\tCreated folder', folder_creation_response.json()['full_name'])
+    return folder_creation_response.json()['id']
+
+
+def get_folder_ids(directories):
+    """Map local directories (relative to `--working-directory`) to the IDs of their Canvas folders, creating any that
+    are missing. Existing folders are found using a single listing of all of the course's folders; missing folders
+    are then created concurrently, one level at a time (as each folder's parent must exist before it can be created).
+    Returns a dict of {directory: folder ID} that includes the selected folder itself as the empty directory"""
+    directory_ids = {'': selected_folder['id']}
+    required_directories = set()
+    for directory in directories:
+        while directory:
+            required_directories.add(directory)
+            directory = os.path.dirname(directory)
+    if not required_directories:
+        return directory_ids
+
+    course_folders_response = Utils.canvas_multi_page_request('%s/folders' % COURSE_URL, type_hint='course folders')
+    if not course_folders_response:
+        print('ERROR: unable to retrieve list of course folders; aborting')
+        sys.exit()
+    course_folders = {folder['full_name']: folder['id'] for folder in json.loads(course_folders_response)}
+    for directory in required_directories:
+        folder_name = '%s/%s' % (selected_folder['full_name'], directory.replace(os.sep, '/'))
+        if folder_name in course_folders:
+            directory_ids[directory] = course_folders[folder_name]
+
+    missing_directories = sorted(required_directories - directory_ids.keys())
+    print('Found', len(required_directories) - len(missing_directories), 'existing Canvas folders;',
+          len(missing_directories), 'to create:', missing_directories)
+    if args.dry_run:
+        return directory_ids
+
+    for depth in sorted(set(directory.count(os.sep) for directory in missing_directories)):
+        # folders whose parent could not be created are skipped (as are the files within them)
+        level_directories = [directory for directory in missing_directories if directory.count(os.sep) == depth and
+                             os.path.dirname(directory) in directory_ids]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=FOLDER_MAX_WORKERS) as executor:
+            for directory, folder_id in zip(level_directories, executor.map(
+                    lambda d: create_folder(d, directory_ids[os.path.dirname(d)]), level_directories)):
+                if folder_id:
+                    directory_ids[directory] = folder_id
+    return directory_ids
+
+
 args = Args.interactive(get_args)
 COURSE_URL = Utils.course_url_to_api(args.url[0]).split('/files')[0]
+API_ROOT = COURSE_URL.split('/courses')[0]
 try:
     COURSE_ROOT, FOLDER_ROOT = args.url[0].split('/files/folder/')
 except ValueError:
@@ -75,7 +224,7 @@ if folder_path_response.status_code != 200:
     sys.exit()
 
 selected_folder = folder_path_response.json()[-1]  # this API provides the requested folder last
-selected_folder_api_path = '%s/folders/%s/files' % (COURSE_URL.split('/courses')[0], selected_folder['id'])
+selected_folder_api_path = '%s/folders/%s/files' % (API_ROOT, selected_folder['id'])
 print('Found requested Canvas folder:', selected_folder)
 
 # getting media IDs is a single-purpose option
@@ -103,66 +252,141 @@ if not os.path.exists(args.working_directory):
     print('ERROR: unable to find working directory', args.working_directory)
     sys.exit()
 
-selected_files = [f for f in os.listdir(args.working_directory) if
-                  re.match(args.filename_pattern, f, flags=re.IGNORECASE)]
+if args.recursive:
+    selected_files = []
+    for directory_path, _, directory_files in os.walk(args.working_directory):
+        directory = os.path.relpath(directory_path, args.working_directory)
+        selected_files.extend(os.path.join(directory, f) if directory != os.curdir else f for f in directory_files if
+                              (directory != os.curdir or f not in SYNC_CACHE_FILES) and
+                              re.match(args.filename_pattern, f, flags=re.IGNORECASE))
+    selected_files.sort()
+else:
+    selected_files = sorted(f for f in os.listdir(args.working_directory) if f not in SYNC_CACHE_FILES and
+                            re.match(args.filename_pattern, f, flags=re.IGNORECASE))
 print('Found', len(selected_files), 'files to upload:', selected_files)
 
-# finally, we upload and, if requested, set the licence type and publish the files
-for file in selected_files:
-    file_path = os.path.join(args.working_directory, file)
-    file_mime_type = args.file_mime_type or mimetypes.guess_type(file_path)[0]
-    _, file_extension = os.path.splitext(file_path)
-    file_name = '%s%s' % (uuid.uuid4().hex, file_extension) if args.randomise_names else file
-    print('Uploading', file, 'with MIME type', file_mime_type, 'and random name' if args.randomise_names else '',
-          file_name)
+session = requests.Session()
+folder_ids = get_folder_ids(set(os.path.dirname(file) for file in selected_files) - {''})
 
-    uploaded_file_id = None
-    if not args.dry_run:
-        # we first need to request an upload URL, then send the actual data
-        submission_form_data = {
-            'name': file_name,
-            'content_type': file_mime_type
-        }
-        file_upload_url_response = requests.post(selected_folder_api_path, data=submission_form_data,
-                                                 headers=Utils.canvas_api_headers())
-        if file_upload_url_response.status_code != 200:
-            print('\tERROR: unable to retrieve file upload URL; skipping')
+# in sync mode, files are compared against a single listing of the existing Canvas files, and only those that are new or
+# have changed are uploaded
+sync_cache_path = os.path.join(args.working_directory, SYNC_CACHE_FILE)
+sync_cache = {}
+folder_sync_cache = {}  # the entries for this Canvas folder, as {local file: {size, mtime_ns, sha256, file_id}}
+if args.sync:
+    if args.randomise_names:
+        print('ERROR: `--sync` cannot be used with `--randomise-names` (as files are compared by name) - aborting')
+        sys.exit()
+    if os.path.exists(sync_cache_path):
+        try:
+            with open(sync_cache_path) as sync_cache_file:
+                sync_cache = json.load(sync_cache_file)
+        except (OSError, ValueError) as e:
+            print('WARNING: unable to read sync record', sync_cache_path, '(%s) - all files will be compared by name '
+                  'and size only' % e)
+        if not isinstance(sync_cache, dict):
+            sync_cache = {}
+    folder_sync_cache = sync_cache.setdefault(str(selected_folder['id']), {})
+
+    # all of the course's files need to be listed in recursive mode; otherwise, just those in the selected folder
+    existing_files = Utils.canvas_multi_page_request('%s/files' % COURSE_URL if args.recursive else
+                                                     selected_folder_api_path, type_hint='existing files')
+    if existing_files is None:
+        print('ERROR: unable to retrieve list of existing files; aborting')
+        sys.exit()
+    existing_files = json.loads(existing_files)
+    canvas_files = {(file['folder_id'], file['display_name']): file for file in existing_files}
+    canvas_files_by_id = {file['id']: file for file in existing_files}
+
+    unchanged_files = set()
+    for file in selected_files:
+        # the file ID recorded at the last upload is preferred, as Canvas may have renamed the file on upload (e.g.,
+        # when a file of the same name already existed); name-based lookup handles files not uploaded in sync mode
+        file_folder_id = folder_ids.get(os.path.dirname(file))
+        cached_entry = folder_sync_cache.get(file)
+        canvas_file = canvas_files_by_id.get(cached_entry.get('file_id')) if cached_entry else None
+        if not canvas_file or canvas_file['folder_id'] != file_folder_id:
+            canvas_file = canvas_files.get((file_folder_id, os.path.basename(file)))
+        if not canvas_file or canvas_file['size'] != os.path.getsize(os.path.join(args.working_directory, file)):
             continue
+        current_entry = get_sync_cache_entry(file, cached_entry)
+        if cached_entry and cached_entry['sha256'] != current_entry['sha256']:
+            continue  # same size, but the content has changed since the last upload
+        current_entry['file_id'] = canvas_file['id']
+        folder_sync_cache[file] = current_entry
+        unchanged_files.add(file)
+    selected_files = [file for file in selected_files if file not in unchanged_files]
+    print('Sync mode: skipping', len(unchanged_files), 'unchanged files;', len(selected_files),
+          'new or changed files to upload:', selected_files)
 
-        file_upload_url_json = file_upload_url_response.json()
-        print('\tUploading file to', file_upload_url_json['upload_url'].split('?')[0], '[truncated]')
+# finally, we upload and, if requested, set the licence type and publish the files
+if args.dry_run:
+    for file in selected_files:
+        file_path = os.path.join(args.working_directory, file)
+        print('DRY RUN: skipping upload of', file, 'with MIME type', args.file_mime_type or
+              mimetypes.guess_type(file_path)[0], 'and random name' if args.randomise_names else '')
+        if args.license:
+            print('\tDRY RUN: skipping license configuration step')
+    sys.exit()
 
-        files_data = {'file': (file_name, open(file_path, 'rb'))}
-        file_upload_response = requests.post(file_upload_url_json['upload_url'],
-                                             data=submission_form_data, files=files_data,
-                                             headers=Utils.canvas_api_headers())
+unavailable_files = [file for file in selected_files if os.path.dirname(file) not in folder_ids]
+if unavailable_files:
+    print('WARNING: skipping', len(unavailable_files), 'files whose Canvas folder could not be created:',
+          unavailable_files)
+    selected_files = [file for file in selected_files if os.path.dirname(file) in folder_ids]
+upload_progress = TransferProgress(sum(os.path.getsize(os.path.join(args.working_directory, file))
+                                       for file in selected_files), len(selected_files))
 
-        if file_upload_response.status_code != 201:  # note: 201 Created
-            print('\tERROR: unable to upload file; skipping:', file_upload_response.text)
-            continue
+# files are uploaded concurrently, alternating between the largest and smallest remaining files so that a few large
+# uploads do not occupy every worker (and small files' per-request overheads are overlapped with large transfers)
+files_by_size = sorted(selected_files, key=lambda f: os.path.getsize(os.path.join(args.working_directory, f)),
+                       reverse=True)
+upload_order = []
+while files_by_size:
+    upload_order.append(files_by_size.pop(0))
+    if files_by_size:
+        upload_order.append(files_by_size.pop())
 
-        file_upload_json = file_upload_response.json()
-        uploaded_file_id = file_upload_json['id']
-        print('\tSuccessfully saved file', file_upload_json['id'], 'at',
-              '%s%s' % (args.url[0].split('/courses')[0], file_upload_json['preview_url'].split('?')[0]))
-    else:
-        print('\tDRY RUN: skipping file upload step')
-
-    if args.license:
-        print('\tSetting file license type to', args.license, 'and publishing' if args.publish else '', end='... ')
-        if args.dry_run:
-            print('\n\tDRY RUN: skipping license configuration step')
-            continue
+with concurrent.futures.ThreadPoolExecutor(max_workers=UPLOAD_MAX_WORKERS) as executor:
+    uploaded_files = dict(zip(upload_order, executor.map(upload_file, upload_order)))
 
-        if uploaded_file_id:
-            license_configuration = {
-                'file_ids[]': uploaded_file_id,
-                'publish': 'false' if not args.publish else args.publish,
-                'usage_rights[use_justification]': args.license
-            }
-            license_update_response = requests.put('%s/usage_rights' % COURSE_URL, params=license_configuration,
-                                                   headers=Utils.canvas_api_headers())
-            if license_update_response.status_code != 200:
-                print('\n\tERROR: unable to set license; skipping:', license_update_response.text)
-                continue
-            print('success')
+# the licence type and publication state of all uploaded files are set in batches, rather than one request per file
+successful_files = [file for file in selected_files if uploaded_files[file]]
+if args.license and successful_files:
+    print('\nSetting license type of', len(successful_files), 'files to', args.license,
+          'and publishing' if args.publish else '')
+    for batch_start in range(0, len(successful_files), LICENSE_BATCH_SIZE):
+        license_batch = successful_files[batch_start:batch_start + LICENSE_BATCH_SIZE]
+        license_configuration = {
+            'file_ids[]': [uploaded_files[file]['id'] for file in license_batch],
+            'publish': 'false' if not args.publish else args.publish,
+            'usage_rights[use_justification]': args.license
+        }
+        license_update_response = session.put('%s/usage_rights' % COURSE_URL, data=license_configuration,
+                                              headers=Utils.canvas_api_headers())
+        if license_update_response.status_code != 200:
+            print('\tERROR: unable to set license for', len(license_batch), 'files -', license_update_response.text,
+                  '- please check the configuration of:', license_batch)
+        else:
+            print('\tSet license type for', len(license_batch), 'files')
+
+if args.sync:
+    for file in successful_files:
+        folder_sync_cache[file] = get_sync_cache_entry(file, folder_sync_cache.get(file))
+        folder_sync_cache[file]['file_id'] = uploaded_files[file]['id']
+    # the record is written to a temporary file then renamed so that an interrupted run never leaves it truncated
+    partial_sync_cache_path = os.path.join(args.working_directory, SYNC_CACHE_FILES[1])
+    with open(partial_sync_cache_path, 'w') as sync_cache_file:
+        json.dump(sync_cache, sync_cache_file)
+    os.replace(partial_sync_cache_path, sync_cache_path)
+
+# results are listed in the original (alphabetical) order, regardless of the order in which uploads finished
+failed_files = [file for file in selected_files if not uploaded_files[file]]
+print('\nUploaded', len(selected_files) - len(failed_files), 'of', len(selected_files), 'files',
+      '(%s)' % upload_progress.status())
+for file in selected_files:
+    if uploaded_files[file]:
+        print('\t', file, ':', '%s/files/%s/file_preview' % (COURSE_ROOT, uploaded_files[file]['id']), ':',
+              uploaded_files[file].get('media_entry_id') or '[no media ID yet - see `--get-media-ids`]')
+if failed_files:
+    print('WARNING: unable to upload', len(failed_files), 'files - see above for details:', failed_files)
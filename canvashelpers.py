@@ -3,17 +3,25 @@
 __author__ = 'Simon Robinson'
 __copyright__ = 'Copyright (c) 2024 Simon Robinson'
 __license__ = 'Apache 2.0'
-__version__ = '2024-04-05'  # ISO 8601 (YYYY-MM-DD)
+__version__ = '2026-10-19'  # ISO 8601 (YYYY-MM-DD)
 
 import configparser
 import csv
+import hashlib
 import json
+import mimetypes
 import os
 import re
+import shutil
 import sys
 import tempfile
+import threading
+import time
+import uuid
+import zipfile
 
 import openpyxl
+import openpyxl.utils
 import requests.structures
 
 
@@ -36,6 +44,9 @@ class Config:
 
 
 class Utils:
+    SPREADSHEET_CACHE_DIRECTORY = os.path.join(tempfile.gettempdir(), 'canvashelpers-spreadsheet-cache')
+    login_id_cache = {}  # {Canvas user ID: Login ID}, shared by every lookup in a run (see get_canvas_user_login_id)
+
     @staticmethod
     def course_url_to_api(url):
         return url.rstrip('/').replace('/courses', '/api/v1/courses')
@@ -258,8 +269,8 @@ class Utils:
     def get_assignment_submissions(assignment_url, includes=None):
         """Get a list of assignment submissions, returning a string that can be parsed as JSON. This function is simply
         a wrapper around Utils.canvas_multi_page_request, but is kept to separate the API parameter complexity from
-        the scripts that use this method"""
-        # TODO: handle variants (include[]=submission_history): canvas.instructure.com/doc/api/submissions.html
+        the scripts that use this method. To retrieve all previous attempts in the same request, pass
+        includes=['submission_history']"""
         # TODO: does requesting group option when there are no groups cause any problems? (no issues seen so far)
         # see: https://canvas.instructure.com/doc/api/submissions.html#method.submissions_api.index
         params = {'include[]': []}
@@ -269,6 +280,20 @@ class Utils:
         return Utils.canvas_multi_page_request('%s/submissions' % assignment_url, params=params,
                                                type_hint='assignment submissions list')
 
+    @staticmethod
+    def get_course_submissions(course_url, assignment_ids, includes=None):
+        """Get the submissions of all students for several assignments in a single (paginated) list, returning a string
+        that can be parsed as JSON. Each submission's `assignment_id` identifies its assignment. Note that, unlike
+        Utils.get_assignment_submissions, group details are not included, so group assignments need to be requested
+        individually"""
+        # see: https://canvas.instructure.com/doc/api/submissions.html#method.submissions_api.for_students
+        params = {'student_ids[]': 'all', 'assignment_ids[]': list(assignment_ids), 'include[]': []}
+        includes = ['user'] + (includes if includes else [])
+        for param in includes:
+            params['include[]'].append(param)
+        return Utils.canvas_multi_page_request('%s/students/submissions' % course_url, params=params,
+                                               type_hint='course submissions list')
+
     @staticmethod
     def filter_assignment_submissions(assignment_url, submission_list_json, groups_mode=False,
                                       include_unsubmitted=False, ignored_users=None, sort_entries=False):
@@ -342,20 +367,89 @@ class Utils:
 
     @staticmethod
     def get_marks_mapping(marks_file):
+        if not os.path.exists(marks_file):
+            return {}
+        return Utils.get_cached_spreadsheet_mapping(marks_file, 'marks', Utils.parse_marks_file_rows)
+
+    @staticmethod
+    def parse_marks_file_rows(rows):
         marks_map = {}
-        if os.path.exists(marks_file):
-            if marks_file.lower().endswith('.xlsx'):
-                marks_workbook = openpyxl.load_workbook(marks_file)
-                marks_sheet = marks_workbook[marks_workbook.sheetnames[0]]
-                for row in marks_sheet.iter_rows():
-                    Utils.parse_marks_file_row(marks_map, [entry.value for entry in row])
-            else:
-                with open(marks_file, newline='') as marks_csv:
-                    reader = csv.reader(marks_csv)
-                    for row in reader:
-                        Utils.parse_marks_file_row(marks_map, row)
+        for row in rows:
+            Utils.parse_marks_file_row(marks_map, row)
         return marks_map
 
+    @staticmethod
+    def read_spreadsheet_rows(spreadsheet_file):
+        """Yield the rows of the first sheet of an XLSX or CSV file (chosen by the file's extension) as lists of cell
+        values. XLSX files are read in openpyxl's read-only mode, which streams rows from the file rather than loading
+        the whole workbook (and its formatting) into memory. Formula cells give their last calculated value"""
+        if spreadsheet_file.lower().endswith('.xlsx'):
+            workbook = openpyxl.load_workbook(spreadsheet_file, read_only=True, data_only=True)
+            try:
+                sheet = workbook[workbook.sheetnames[0]]
+                sheet.reset_dimensions()  # some tools save incorrect dimensions, which would truncate rows
+                for row in sheet.iter_rows(values_only=True):
+                    yield list(row)
+            finally:
+                workbook.close()  # read-only workbooks keep their file open until closed
+        else:
+            with open(spreadsheet_file, newline='') as spreadsheet_csv:
+                yield from csv.reader(spreadsheet_csv)
+
+    @staticmethod
+    def get_cached_spreadsheet_mapping(spreadsheet_file, mapping_type, parse_rows):
+        """Parse a spreadsheet by passing its rows (see Utils.read_spreadsheet_rows) to `parse_rows`, which must return
+        a JSON-serialisable dict. The result is cached on disk (keyed by the file's path, size and modification time,
+        and the given mapping_type), so repeated runs with an unchanged file do not need to parse it again"""
+        file_stat = os.stat(spreadsheet_file)
+        cache_directory = Utils._get_private_cache_directory(Utils.SPREADSHEET_CACHE_DIRECTORY)
+        if not cache_directory:
+            print('WARNING: cache directory', Utils.SPREADSHEET_CACHE_DIRECTORY, 'is not private - skipping',
+                  mapping_type, 'mapping cache for', spreadsheet_file)
+            return parse_rows(Utils.read_spreadsheet_rows(spreadsheet_file))
+
+        file_key = '%s:%s' % (mapping_type, os.path.realpath(spreadsheet_file))
+        cache_file = os.path.join(cache_directory, '%s.json' % hashlib.sha256(file_key.encode('utf-8')).hexdigest())
+        try:
+            with open(cache_file) as cached_mapping_file:
+                cached_mapping = json.load(cached_mapping_file)
+            if cached_mapping['mtime_ns'] == file_stat.st_mtime_ns and cached_mapping['size'] == file_stat.st_size:
+                print('Using cached', mapping_type, 'mapping for', spreadsheet_file)
+                return cached_mapping['mapping']
+        except (OSError, ValueError, KeyError):
+            pass  # no cache (or an unreadable one) - parse the file instead
+
+        mapping = parse_rows(Utils.read_spreadsheet_rows(spreadsheet_file))
+        temp = None
+        try:
+            # NamedTemporaryFile creates files that only the current user can read (0600), and os.replace keeps this
+            with tempfile.NamedTemporaryFile(mode='w', dir=cache_directory, delete=False) as temp:
+                json.dump({'mtime_ns': file_stat.st_mtime_ns, 'size': file_stat.st_size, 'mapping': mapping}, temp)
+            os.replace(temp.name, cache_file)
+        except (OSError, TypeError, ValueError) as e:  # TypeError/ValueError: the mapping is not JSON-serialisable
+            print('WARNING: unable to cache', mapping_type, 'mapping for', spreadsheet_file, '-', e)
+            if temp and os.path.exists(temp.name):
+                os.remove(temp.name)
+        return mapping
+
+    @staticmethod
+    def _get_private_cache_directory(cache_directory):
+        """Create (if needed) a cache directory that only the current user can access, returning its path, or None if
+        it cannot be created or is accessible to others (e.g., a directory of the same name created by another user in
+        a shared temporary folder). Cached data may contain student marks, so it must not be readable by other users"""
+        try:
+            os.makedirs(cache_directory, mode=0o700, exist_ok=True)
+            if not hasattr(os, 'getuid'):
+                return cache_directory  # permission checks are only possible on POSIX systems
+            directory_stat = os.stat(cache_directory)
+            if directory_stat.st_uid != os.getuid():
+                return None
+            if directory_stat.st_mode & 0o077:
+                os.chmod(cache_directory, 0o700)  # e.g., a directory created by an earlier version of this script
+        except OSError:
+            return None
+        return cache_directory
+
     @staticmethod
     def get_assignment_student_list(assignment_url):
         """For a given assignment, get the list of students it is assigned to. In most cases it is better to use
@@ -381,7 +475,11 @@ class Utils:
 
     @staticmethod
     def get_canvas_user_login_id(assignment_url, user_id):
-        # Canvas has a bug where login_id is missing in some requests - need to get individually (slowly...)
+        # Canvas has a bug where login_id is missing in some requests - need to get individually (slowly...); results
+        # are cached so that each user is only requested once, and scripts that process several assignments can also
+        # add their course roster to Utils.login_id_cache in advance to avoid these requests altogether
+        if user_id in Utils.login_id_cache:
+            return Utils.login_id_cache[user_id]
         print('WARNING: encountered Canvas bug in user list; requesting profile for', user_id, 'individually')
         user_profile_response = requests.get('%s/users/%s/profile' % (assignment_url.split('/courses')[0], user_id),
                                              headers=Utils.canvas_api_headers())
@@ -389,7 +487,101 @@ class Utils:
             print('ERROR: unable to load user profile for', user_id)
             return None  # TODO: is there anything else we can do?
         else:
-            return user_profile_response.json()['login_id']
+            Utils.login_id_cache[user_id] = user_profile_response.json()['login_id']
+            return Utils.login_id_cache[user_id]
+
+    @staticmethod
+    def get_file_sha256(file_path):
+        file_hash = hashlib.sha256()
+        with open(file_path, 'rb') as hash_file:
+            for chunk in iter(lambda: hash_file.read(1024 * 1024), b''):
+                file_hash.update(chunk)
+        return file_hash.hexdigest()
+
+    @staticmethod
+    def get_attachment_index(input_directory, extension, mime_type=None):
+        """Index the files in input_directory that have the given extension in a single pass, so that matching
+        attachments to many students or groups does not need a separate filesystem lookup for each one. Returns a dict
+        of {file name without extension: {'file_name', 'path', 'mime_type'}}; mime_type is guessed from the file's name
+        if not given, and is None if it is not recognised"""
+        attachment_index = {}
+        if not os.path.isdir(input_directory):
+            return attachment_index
+        file_suffix = '.%s' % extension
+        with os.scandir(input_directory) as directory_entries:
+            for entry in directory_entries:
+                if entry.name.endswith(file_suffix) and entry.is_file():
+                    attachment_index[entry.name[:-len(file_suffix)]] = {
+                        'file_name': entry.name, 'path': entry.path,
+                        'mime_type': mime_type or mimetypes.guess_type(entry.name)[0]}
+        return attachment_index
+
+    @staticmethod
+    def upload_file(upload_url, form_data, file_name, file_path, mime_type=None, session=None, progress=None):
+        """Upload a file to a Canvas upload URL (as returned by any of the API's file upload endpoints), streaming its
+        contents from disk rather than building the whole request in memory. The file is always closed afterwards, even
+        if the upload fails. Pass a TransferProgress to track throughput; the bytes of failed uploads are removed from
+        its total again so that any retries are not counted twice. Returns the upload response"""
+        with MultipartFileStream(form_data, file_name, file_path, mime_type=mime_type, progress=progress) as stream:
+            upload_headers = Utils.canvas_api_headers()
+            upload_headers['Content-Type'] = stream.content_type
+            try:
+                upload_response = (session or requests).post(upload_url, data=stream, headers=upload_headers)
+            except requests.exceptions.RequestException:
+                stream.discard_progress()
+                raise
+            if not upload_response.ok:
+                stream.discard_progress()
+            return upload_response
+
+    @staticmethod
+    def extract_archive(archive_path, output_directory, max_total_bytes, max_files, max_compression_ratio):
+        """Extract a zip archive into output_directory, refusing archives whose contents exceed any of the given limits
+        (a basic guard against "zip bombs") or that contain entries which would be written outside output_directory.
+        Both the sizes declared in the archive and the number of bytes actually written are checked. This method is
+        designed to be run in a separate process, so rather than printing it returns a tuple of (success, message). If
+        output_directory did not already exist, it is removed when extraction fails part-way through"""
+        output_directory_existed = os.path.exists(output_directory)
+        success, message = Utils._extract_archive_entries(archive_path, output_directory, max_total_bytes, max_files,
+                                                          max_compression_ratio)
+        if not success and not output_directory_existed:
+            shutil.rmtree(output_directory, ignore_errors=True)
+        return success, message
+
+    @staticmethod
+    def _extract_archive_entries(archive_path, output_directory, max_total_bytes, max_files, max_compression_ratio):
+        try:
+            with zipfile.ZipFile(archive_path) as archive:
+                entries = [e for e in archive.infolist() if not e.is_dir() and not e.filename.startswith('__MACOSX/')]
+                declared_bytes = sum(entry.file_size for entry in entries)
+                compressed_bytes = sum(entry.compress_size for entry in entries)
+                if len(entries) > max_files:
+                    return False, 'archive contains %d files (limit: %d)' % (len(entries), max_files)
+                if declared_bytes > max_total_bytes:
+                    return False, 'archive expands to %d bytes (limit: %d)' % (declared_bytes, max_total_bytes)
+                if compressed_bytes > 0 and declared_bytes / compressed_bytes > max_compression_ratio:
+                    return False, 'archive compression ratio is %.0f:1 (limit: %d:1)' % (
+                        declared_bytes / compressed_bytes, max_compression_ratio)
+
+                output_root = os.path.realpath(output_directory)
+                written_bytes = 0
+                for entry in entries:
+                    entry_path = os.path.realpath(os.path.join(output_root, entry.filename))
+                    if os.path.commonpath([output_root, entry_path]) != output_root:
+                        return False, 'archive entry %s would be extracted outside the output folder' % entry.filename
+                    os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+                    with archive.open(entry) as entry_file, open(entry_path, 'wb') as output_file:
+                        while True:
+                            chunk = entry_file.read(1024 * 1024)
+                            if not chunk:
+                                break
+                            written_bytes += len(chunk)
+                            if written_bytes > max_total_bytes:
+                                return False, 'archive contents exceed %d bytes when extracted' % max_total_bytes
+                            output_file.write(chunk)
+            return True, '%d files (%d bytes)' % (len(entries), written_bytes)
+        except (zipfile.BadZipFile, OSError, RuntimeError) as e:  # (RuntimeError: encrypted archives)
+            return False, str(e)
 
     @staticmethod
     def parse_marks_file_row(marks_map, row):
@@ -408,6 +600,194 @@ class Utils:
             marks_map[student_number_or_group_name] = marks_map_entry
 
 
+class SpreadsheetWriter:
+    """Write rows to an XLSX or CSV file (chosen by the file's extension) as they are produced, rather than building a
+    complete workbook in memory. XLSX output uses openpyxl's write-only mode, so formatting is limited to what can be
+    set before the first row is written (column widths and a frozen header row) plus merged cells. Rows can be given
+    as lists, or as dicts of {column key: value} that are resolved via an index built when the headers are written.
+    Use as a context manager, or call `close` to finish writing the file"""
+
+    def __init__(self, file_path, headers=None, title=None, column_keys=None, column_widths=None):
+        self.file_path = file_path
+        self.is_xlsx = file_path.lower().endswith('.xlsx')
+        self.headers = None
+        self.column_index = {}
+        self.row_count = 0
+        if self.is_xlsx:
+            self._workbook = openpyxl.Workbook(write_only=True)
+            self._sheet = self._workbook.create_sheet(title)
+            self._sheet.freeze_panes = 'A2'  # set the first row as a header
+        else:
+            self._csv_file = open(file_path, 'w', newline='')
+            self._csv_writer = csv.writer(self._csv_file)
+        if headers:
+            self.write_headers(headers, column_keys=column_keys, column_widths=column_widths)
+
+    def write_headers(self, headers, column_keys=None, column_widths=None):
+        """Write the header row. Columns can later be referred to by their position, their header text or, if headers
+        are not unique, a separate list of column_keys"""
+        self.headers = headers
+        self.column_index = {key: index for index, key in enumerate(column_keys if column_keys else headers)}
+        if self.is_xlsx and column_widths:
+            for column, width in enumerate(column_widths, start=1):
+                self._sheet.column_dimensions[openpyxl.utils.get_column_letter(column)].width = width
+        self.append(headers)
+        self.row_count = 0  # the header row is not counted
+
+    def merge_header_cells(self, first_column, last_column):
+        """Merge header row cells (1-indexed, inclusive). Has no effect on CSV output"""
+        if self.is_xlsx:
+            self._sheet.merged_cells.add('%s1:%s1' % (openpyxl.utils.get_column_letter(first_column),
+                                                      openpyxl.utils.get_column_letter(last_column)))
+
+    def append(self, row):
+        if isinstance(row, dict):
+            row_values = [None] * len(self.headers)
+            for key, value in row.items():
+                row_values[self.column_index[key]] = value
+            row = row_values
+        if self.is_xlsx:
+            self._sheet.append(row)
+        else:
+            self._csv_writer.writerow(row)
+        self.row_count += 1
+
+    def close(self):
+        if self.is_xlsx:
+            self._workbook.save(self.file_path)
+        else:
+            self._csv_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class TransferProgress:
+    """Thread-safe tracking of the progress of a set of concurrent uploads or downloads. Workers call `add` as each
+    chunk of data is transferred; `status` then summarises overall progress, throughput and estimated time remaining"""
+
+    def __init__(self, total_bytes, total_files):
+        self.total_bytes = total_bytes
+        self.total_files = total_files
+        self.transferred_bytes = 0
+        self.completed_files = 0
+        self.start_time = time.monotonic()
+        self._lock = threading.Lock()
+
+    def add(self, byte_count=0, completed_files=0):
+        with self._lock:
+            self.transferred_bytes += byte_count
+            self.completed_files += completed_files
+
+    def add_total(self, byte_count=0, file_count=0):
+        """Increase the totals when more transfers join a queue that has already started"""
+        with self._lock:
+            self.total_bytes += byte_count
+            self.total_files += file_count
+
+    def status(self):
+        with self._lock:
+            transferred_bytes = self.transferred_bytes
+            completed_files = self.completed_files
+        elapsed_time = max(time.monotonic() - self.start_time, 0.001)
+        transfer_rate = transferred_bytes / elapsed_time
+        status = '%d of %d files; %s of %s at %s/s' % (
+            completed_files, self.total_files, TransferProgress.format_bytes(transferred_bytes),
+            TransferProgress.format_bytes(self.total_bytes), TransferProgress.format_bytes(transfer_rate))
+        if 0 < transfer_rate and transferred_bytes < self.total_bytes:
+            remaining_time = int((self.total_bytes - transferred_bytes) / transfer_rate)
+            status += '; about %dm%02ds remaining' % (remaining_time // 60, remaining_time % 60)
+        return status
+
+    @staticmethod
+    def format_bytes(byte_count):
+        for unit in ['B', 'KB', 'MB', 'GB']:
+            if abs(byte_count) < 1024:
+                return '%.1f %s' % (byte_count, unit)
+            byte_count /= 1024
+        return '%.1f TB' % byte_count
+
+
+class MultipartFileStream:
+    """A multipart/form-data request body consisting of a set of form fields followed by a single file. The body is
+    produced in chunks as it is read, so only a small part of the file is ever held in memory, and its length is known
+    in advance so that requests sends a Content-Length header rather than a chunked upload (which Canvas's file storage
+    does not accept). The file is opened when reading starts and closed when it is exhausted, or on `close` (or at the
+    end of a `with` block) if an upload is abandoned part-way. Transferred file bytes are reported to `progress`"""
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, form_data, file_name, file_path, mime_type=None, progress=None):
+        self.file_path = file_path
+        self.progress = progress
+        self.boundary = uuid.uuid4().hex
+        self.content_type = 'multipart/form-data; boundary=%s' % self.boundary
+
+        preamble = []
+        for name, values in form_data.items():
+            for value in values if isinstance(values, list) else [values]:
+                preamble.append('--%s\r\nContent-Disposition: form-data; name="%s"\r\n\r\n%s\r\n' % (
+                    self.boundary, name, value))
+        preamble.append('--%s\r\nContent-Disposition: form-data; name="file"; filename="%s"\r\nContent-Type: %s'
+                        '\r\n\r\n' % (self.boundary, file_name.replace('"', '%22'),
+                                        mime_type or 'application/octet-stream'))
+        self._preamble = ''.join(preamble).encode('utf-8')
+        self._epilogue = ('\r\n--%s--\r\n' % self.boundary).encode('utf-8')
+        self._length = len(self._preamble) + os.path.getsize(file_path) + len(self._epilogue)
+
+        self._chunks = self._generate_chunks()
+        self._buffer = b''
+        self._buffer_is_file = False
+        self._offset = 0
+        self._reported_bytes = 0
+
+    def _generate_chunks(self):
+        yield self._preamble, False
+        with open(self.file_path, 'rb') as upload_file:
+            for chunk in iter(lambda: upload_file.read(MultipartFileStream.CHUNK_SIZE), b''):
+                yield chunk, True
+        yield self._epilogue, False
+
+    def read(self, size=-1):
+        output = []
+        remaining = size if size is not None else -1
+        while remaining != 0:
+            if self._offset >= len(self._buffer):
+                self._buffer, self._buffer_is_file = next(self._chunks, (b'', False))
+                self._offset = 0
+                if not self._buffer:
+                    break
+            end = len(self._buffer) if remaining < 0 else min(len(self._buffer), self._offset + remaining)
+            output.append(self._buffer[self._offset:end])
+            if self.progress and self._buffer_is_file:
+                self.progress.add(end - self._offset)
+                self._reported_bytes += end - self._offset
+            if remaining > 0:
+                remaining -= end - self._offset
+            self._offset = end
+        return b''.join(output)
+
+    def discard_progress(self):
+        """Remove the bytes read so far from `progress` (e.g., because the upload failed)"""
+        if self.progress:
+            self.progress.add(-self._reported_bytes)
+        self._reported_bytes = 0
+
+    def close(self):
+        self._chunks.close()  # closes the file if it is still open
+
+    def __len__(self):
+        return self._length
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
 class Args:
     @staticmethod
     def interactive(f):
@@ -1,69 +1,254 @@
 #!/usr/bin/python3
+"""Select examples of student work for accreditation. Each assignment's scores (from a Canvas gradebook export) are
+divided into quantile bands (e.g., Poor/Average/Good), and a random sample of students from each band is chosen. Their
+submissions (as downloaded by allsubmissions.py) are then copied into a folder for each band."""
 
-import pandas as pd
+import argparse
+import concurrent.futures
+import json
 import os
-import glob
+import re
+import shutil
+import sys
+
 import numpy as np
-from shutil import copy2
+import pandas as pd
 
-grades_file = "2024-12-16T2339_Grades-CSCI_405.csv"
-directory = "./CSCI405_1760059"
-dest_dir = "Student_Work"
-num_picks = 3
-np.random.seed(100)
+from canvashelpers import Utils
 
-grades = pd.read_csv(grades_file)
-grades = grades.drop([0,1]) # 0 = "Manual posting" etc., 1 = "Points possible"
-grades = grades.set_index(np.arange(grades.shape[0])) # reindex from student 0
+try:
+    import fcntl  # used for reflinks (copy-on-write clones), where supported
+except ImportError:
+    fcntl = None
 
-sub_dirs = glob.glob(f"{directory}/*")
+COPY_MAX_WORKERS = 8  # concurrent file copies (or links)
+GRADES_CACHE_FILE = 'grades-cache.npz'  # saved in the submissions directory in `--course-url` mode
 
-def copy_files(assignment_dir, dest_dir, student_ids, prefix_str):
-    for student in student_ids:
-        # assumption: filenames are "user@wwu.edu.pdf"
-        submission = f"{student}.pdf"
-        src_file = f"{assignment_dir}/{submission}"
-        dest_file = f"{dest_dir}/{prefix_str}_{submission}"
-        print(f"copying {src_file} to {dest_file}")
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('grades_file', nargs='?', default=None,
+                        help='The CSV file of the course gradebook exported from Canvas. Not needed if `--course-url` '
+                             'is set')
+    parser.add_argument('--course-url', default=None,
+                        help='Rather than using an exported gradebook, retrieve students\' scores directly from the '
+                             'Canvas API for the course at this URL (e.g., the same URL given to `allsubmissions.py`). '
+                             'Scores are cached in a file named `%s` in the submissions directory and reused in later '
+                             'runs for the same assignments' % GRADES_CACHE_FILE)
+    parser.add_argument('--refresh-cache', action='store_true',
+                        help='In `--course-url` mode, ignore any cached scores and retrieve them from Canvas again')
+    parser.add_argument('--submissions-directory', default='.',
+                        help='The directory containing student work (i.e., the output of `allsubmissions.py`), with '
+                             'one subdirectory per assignment, named as the assignment ID. Default: the current '
+                             'directory')
+    parser.add_argument('--output-directory', default='Student_Work',
+                        help='The directory to copy selected student work to. A subdirectory is created for each of '
+                             'the `--categories`. Default: `Student_Work`')
+    parser.add_argument('--thresholds', nargs='+', type=float, default=[0.1, 0.5, 0.75, 1],
+                        help='The quantiles that divide each assignment\'s scores into categories. Students whose '
+                             'scores are at or above one threshold and below the next are placed in the same category '
+                             '(the final threshold is inclusive). Default: 0.1 0.5 0.75 1')
+    parser.add_argument('--categories', nargs='+', default=['Poor', 'Average', 'Good'],
+                        help='The names of the categories between each pair of `--thresholds` (one fewer than the '
+                             'number of thresholds). Default: Poor Average Good')
+    parser.add_argument('--num-picks', type=int, default=3,
+                        help='The number of students to select from each category for each assignment. Default: 3')
+    parser.add_argument('--seed', type=int, default=100,
+                        help='The random seed used when selecting students, so that repeated runs choose the same '
+                             'students. Default: 100')
+    return parser.parse_args()
+
+
+def index_submissions(submissions_directory):
+    """Walk the downloaded submission tree once, returning {assignment ID: {student: [file paths]}}. Submissions can be
+    single files named as the student (e.g., "user@wwu.edu.pdf", with any extension), or folders named as the student
+    that contain any number of files (`--multiple-attachments` and `--all-attempts` modes). Only directories named as
+    assignment IDs (i.e., all digits) are included, so other folders (e.g., `.git` or previous output) are ignored"""
+    submission_index = {}
+    for assignment_entry in os.scandir(submissions_directory):
+        if not assignment_entry.is_dir() or not assignment_entry.name.isdigit():
+            continue
+        student_files = submission_index.setdefault(assignment_entry.name, {})
+        for student_entry in os.scandir(assignment_entry.path):
+            if student_entry.is_dir():
+                for root, _, files in os.walk(student_entry.path):
+                    student_files.setdefault(student_entry.name, []).extend(
+                        os.path.join(root, file) for file in sorted(files))
+            else:
+                student_files.setdefault(os.path.splitext(student_entry.name)[0], []).append(student_entry.path)
+    return submission_index
+
+
+def link_or_copy(src_file, dest_file, same_filesystem):
+    """Copy a file, but where possible (i.e., on the same filesystem) create a hardlink or a reflink (copy-on-write
+    clone) instead so that the copy costs (almost) no extra I/O or disk space. Returns the method that was used"""
+    if os.path.lexists(dest_file):
+        os.remove(dest_file)
+    if same_filesystem:
         try:
-            copy2(src_file, dest_file)
-        except FileNotFoundError:
-            print("== Warning, file {src_file} missing! ==")
+            os.link(src_file, dest_file)
+            return 'linked'
+        except OSError:
+            pass  # e.g., the filesystem does not support hardlinks - try a reflink instead
+        if fcntl and hasattr(fcntl, 'FICLONE'):
+            try:
+                with open(src_file, 'rb') as src, open(dest_file, 'wb') as dest:
+                    fcntl.ioctl(dest.fileno(), fcntl.FICLONE, src.fileno())
+                shutil.copystat(src_file, dest_file)
+                return 'cloned'
+            except OSError:
+                pass
+    shutil.copy2(src_file, dest_file)
+    return 'copied'
+
+
+def get_copy_jobs(assignment_id, dest_dir, student_ids, prefix_str):
+    """Look up each student's files in the submission index, returning a list of (source, destination) pairs"""
+    copy_jobs = []
+    for student in student_ids:
+        src_files = submission_index.get(assignment_id, {}).get(student)
+        if not src_files:
+            print(f"== Warning, no submission found for {student} in {args.submissions_directory}/{assignment_id}! ==")
+            continue
+        student_dir = os.path.join(args.submissions_directory, assignment_id, student)
+        for src_file in src_files:
+            if os.path.dirname(src_file) == os.path.dirname(student_dir):
+                submission = os.path.basename(src_file)  # a single file named as the student
+            else:
+                submission = f"{student}_{os.path.relpath(src_file, student_dir).replace(os.sep, '_')}"
+            copy_jobs.append((src_file, f"{dest_dir}/{prefix_str}_{submission}"))
+    return copy_jobs
+
+
+def get_api_grades(course_url, assignment_ids):
+    """Build a grade matrix (one row per student, one column per assignment) from Canvas's course-wide submission list,
+    returning a DataFrame in the same format as a gradebook export. Each submission is written straight into a numpy
+    array as it is read (rather than building and pivoting a long table), and the result is cached"""
+    cache_file = os.path.join(args.submissions_directory, GRADES_CACHE_FILE)
+    if os.path.exists(cache_file) and not args.refresh_cache:
+        cache = np.load(cache_file)
+        if sorted(cache['assignment_ids']) == sorted(assignment_ids):
+            print(f"Loaded cached scores for {len(cache['students'])} students from {cache_file}")
+            return grades_from_matrix(cache['students'], cache['columns'], cache['scores'])
+        print(f"Warning, ignoring cached scores in {cache_file} because they are for different assignments")
+
+    if not assignment_ids:
+        print(f"Error, no assignment directories (named as assignment IDs) found in {args.submissions_directory}")
+        sys.exit()
+    api_course_url = Utils.course_url_to_api(course_url)
+    assignments_response = Utils.canvas_multi_page_request(f"{api_course_url}/assignments",
+                                                           type_hint="assignments list")
+    submissions_response = Utils.get_course_submissions(api_course_url, assignment_ids)
+    if not assignments_response or not submissions_response:
+        print(f"Error, unable to retrieve scores from {course_url}")
+        sys.exit()
+    assignment_names = {str(assignment['id']): assignment['name'] for assignment in json.loads(assignments_response)}
+    columns = [f"{assignment_names.get(assignment_id, 'Assignment')} ({assignment_id})"
+               for assignment_id in assignment_ids]
+    column_index = {assignment_id: index for index, assignment_id in enumerate(assignment_ids)}
+
+    submissions = json.loads(submissions_response)
+    student_index = {}
+    scores = np.full((len({submission['user_id'] for submission in submissions}), len(assignment_ids)), np.nan,
+                     dtype=np.float32)
+    students = []
+    for submission in submissions:
+        user_id = submission['user_id']
+        if user_id not in student_index:
+            student_index[user_id] = len(students)
+            user = submission.get('user', {})
+            students.append(user['login_id'] if 'login_id' in user else
+                            Utils.get_canvas_user_login_id(api_course_url, user_id))
+        if submission.get('score') is not None:
+            scores[student_index[user_id], column_index[str(submission['assignment_id'])]] = submission['score']
+
+    students = np.array(students, dtype=str)
+    np.savez_compressed(cache_file, students=students, columns=np.array(columns, dtype=str),
+                        assignment_ids=np.array(assignment_ids, dtype=str), scores=scores)
+    print(f"Retrieved scores for {len(students)} students and {len(assignment_ids)} assignments; saved to {cache_file}")
+    return grades_from_matrix(students, columns, scores)
+
+
+def grades_from_matrix(students, columns, scores):
+    grades = pd.DataFrame(scores, columns=list(columns))
+    grades.insert(0, 'SIS Login ID', students)
+    return grades
+
 
 def clean_str(str):
     return str.replace(' ', '_').replace('(', '').replace(')', '')
 
-for sub_dir in sub_dirs:
-    assignment_id = sub_dir.split('/')[-1]
-    column = grades.filter(regex=assignment_id, axis=1).astype(float)
-    if column.shape[1] == 0:
-        print(f"Warning, no column found in {grades_file} for id {assignment_id}")
-    elif column.shape[1] > 1:
-        print(f"Error, more than 1 column found in {grades_file} for id {assignment_id}")
+
+args = get_args()
+if len(args.categories) != len(args.thresholds) - 1:
+    print(f"Error, {len(args.thresholds)} thresholds define {len(args.thresholds) - 1} categories, but",
+          f"{len(args.categories)} category names were given")
+    sys.exit()
+thresholds = np.array(sorted(args.thresholds))
+
+if not args.grades_file and not args.course_url:
+    print("Error, please provide either a gradebook CSV file or a `--course-url` to retrieve scores from")
+    sys.exit()
+submission_index = index_submissions(args.submissions_directory)
+
+if args.course_url:
+    args.grades_file = args.course_url  # for messages only
+    grades = get_api_grades(args.course_url, sorted(submission_index))
+else:
+    grades = pd.read_csv(args.grades_file)
+    grades = grades.drop([0, 1])  # 0 = "Manual posting" etc., 1 = "Points possible"
+    grades = grades.set_index(np.arange(grades.shape[0]))  # reindex from student 0
+
+# match each assignment directory to its gradebook column (Canvas names these as "[assignment name] ([assignment ID])")
+assignment_columns = {}
+for assignment_id in submission_index:
+    columns = [column for column in grades.columns if re.search(rf'\({re.escape(assignment_id)}\)\s*$', column)]
+    if len(columns) == 0:
+        print(f"Warning, no column found in {args.grades_file} for id {assignment_id}")
+    elif len(columns) > 1:
+        print(f"Error, more than 1 column found in {args.grades_file} for id {assignment_id}")
     else:
-        col_data = np.array(column).flatten() # may include NaN for missing
+        assignment_columns[columns[0]] = assignment_id
 
-        if np.all(np.logical_or(col_data == 0, np.isnan(col_data))):
-            print(f"Warning, skipping columns \"{column.columns[0]}\"")
-            continue
+# melt the gradebook into long form (one row per student per assignment), ignoring missing scores
+scores = grades.melt(id_vars='SIS Login ID', value_vars=list(assignment_columns), var_name='column', value_name='score')
+scores['score'] = pd.to_numeric(scores['score'], errors='coerce')
+scores = scores.dropna(subset=['score'])
+
+marked = (scores['score'] != 0).groupby(scores['column']).any()  # columns that are entirely 0 or missing are skipped
+for column in assignment_columns:
+    if not marked.get(column, False):
+        print(f"Warning, skipping columns \"{column}\"")
+scores = scores[scores['column'].map(marked)]
 
-        bins = np.nanquantile(col_data, [0.1, 0.5, 0.75, 1], method="inverted_cdf")
-        # find bins for poor/middle/good scores
-        low_idx = (col_data >= bins[0]) * (col_data < bins[1])
-        mid_idx = (col_data >= bins[1]) * (col_data < bins[2])
-        top_idx = (col_data >= bins[2]) * (col_data <= bins[3])
-        # indices of students in bisn
-        low_students = np.random.choice(np.where(low_idx)[0], num_picks, replace=False)
-        mid_students = np.random.choice(np.where(mid_idx)[0], num_picks, replace=False)
-        top_students = np.random.choice(np.where(top_idx)[0], num_picks, replace=False)
-        # list of student emails
-        low_emails = list(grades['SIS Login ID'].iloc[low_students])
-        mid_emails = list(grades['SIS Login ID'].iloc[mid_students])
-        top_emails = list(grades['SIS Login ID'].iloc[top_students])
-
-        prefix_str = clean_str(column.columns[0])
-        copy_files(sub_dir, f"{dest_dir}/Poor", low_emails, prefix_str)
-        copy_files(sub_dir, f"{dest_dir}/Average", mid_emails, prefix_str)
-        copy_files(sub_dir, f"{dest_dir}/Good", top_emails, prefix_str)
-        
-        #break
+# a score is at or above an assignment's q quantile (using the inverted CDF definition) exactly when the proportion of
+# that assignment's scores at or below it is at least q, so all assignments can be binned at once using their ranks
+score_cdf = scores.groupby('column')['score'].rank(method='max', pct=True)
+category = np.searchsorted(thresholds, score_cdf.to_numpy(), side='right') - 1
+category[np.isclose(score_cdf.to_numpy(), thresholds[-1])] = len(thresholds) - 2  # final threshold is inclusive
+scores['category'] = category
+scores = scores[(scores['category'] >= 0) & (scores['category'] < len(thresholds) - 1)]
+
+# stratified sample: shuffle once, then take the first num_picks students from each assignment's category
+picks = scores.sample(frac=1, random_state=args.seed).groupby(['column', 'category']).head(args.num_picks)
+category_sizes = scores.groupby(['column', 'category']).size()
+for (column, category_index), size in category_sizes[category_sizes < args.num_picks].items():
+    print(f"Warning, only {size} students in category {args.categories[category_index]} for \"{column}\"")
+
+copy_jobs = []
+for (column, category_index), category_picks in picks.groupby(['column', 'category']):
+    category_dir = f"{args.output_directory}/{args.categories[category_index]}"
+    copy_jobs.extend(get_copy_jobs(assignment_columns[column], category_dir, list(category_picks['SIS Login ID']),
+                                   clean_str(column)))
+
+for category_name in args.categories:
+    os.makedirs(f"{args.output_directory}/{category_name}", exist_ok=True)
+same_filesystem = os.stat(args.submissions_directory).st_dev == os.stat(args.output_directory).st_dev
+with concurrent.futures.ThreadPoolExecutor(max_workers=COPY_MAX_WORKERS) as executor:
+    copy_futures = {executor.submit(link_or_copy, *job, same_filesystem): job for job in copy_jobs}
+    for future in concurrent.futures.as_completed(copy_futures):
+        src_file, dest_file = copy_futures[future]
+        try:
+            print(f"{future.result()} {src_file} to {dest_file}")
+        except OSError as e:
+            print(f"== Warning, unable to copy {src_file} to {dest_file}: {e} ==")
@@ -4,16 +4,13 @@ include a unique attachment file."""
 __author__ = 'Simon Robinson'
 __copyright__ = 'Copyright (c) 2024 Simon Robinson'
 __license__ = 'Apache 2.0'
-__version__ = '2024-03-14'  # ISO 8601 (YYYY-MM-DD)
+__version__ = '2026-10-19'  # ISO 8601 (YYYY-MM-DD)
 
 import argparse
-import csv
 import json
-import mimetypes
 import os
 import sys
 
-import openpyxl
 import requests
 
 from canvashelpers import Args, Utils
@@ -75,6 +72,15 @@ def get_args():
     return parser.parse_args()
 
 
+def parse_comments_file_rows(rows):
+    parsed_comments = {}
+    for row in rows:
+        if len(row) > 1 and row[0] is not None:
+            # identifiers are always strings (as in Utils.parse_marks_file_row), even if stored as numbers in XLSX files
+            parsed_comments[str(row[0])] = row[1]
+    return parsed_comments
+
+
 args = Args.interactive(get_args)
 COURSE_URL = Utils.course_url_to_api(args.url[0])
 COURSE_ID = Utils.get_course_id(COURSE_URL)
@@ -134,16 +140,7 @@ comments_map = {}
 if args.comments_file:
     comments_file = os.path.join(INPUT_DIRECTORY, args.comments_file)
     if os.path.exists(comments_file):
-        if comments_file.lower().endswith('.xlsx'):
-            comments_workbook = openpyxl.load_workbook(comments_file)
-            comments_sheet = comments_workbook[comments_workbook.sheetnames[0]]
-            for row in comments_sheet.iter_rows():
-                comments_map[row[0].value] = row[1].value
-        else:
-            with open(comments_file, newline='') as marks_csv:
-                reader = csv.reader(marks_csv)
-                for row in reader:
-                    comments_map[row[0]] = row[1]
+        comments_map = Utils.get_cached_spreadsheet_mapping(comments_file, 'comments', parse_comments_file_rows)
         print('Loaded comments mapping for', len(comments_map), 'people/groups:', comments_map)
     else:
         print('Ignoring comments file argument', args.comments_file, '- not found in course directory at',
@@ -174,6 +171,20 @@ print('Generating', len(message_recipient_json), 'conversations and uploading at
       '%s/files/folder/users_%d/%s' % (args.url[0].split('/courses')[0], SELF_ID,
                                        FILES_SUBFOLDER_PATH.replace(' ', '%20')))  # display formatting only
 
+# attachments are matched against a single listing of the input directory, and any that do not match a recipient are
+# reported before any messages are sent
+attachment_index = Utils.get_attachment_index(INPUT_DIRECTORY, args.attachment_extension,
+                                              mime_type=args.attachment_mime_type)
+recipient_identifiers = set(message_recipient_json[recipient][0]['group_name'] if args.groups else recipient['login_id']
+                            for recipient in message_recipient_json)
+unmatched_attachment_files = sorted(attachment['file_name'] for identifier, attachment in attachment_index.items() if
+                                    identifier not in recipient_identifiers and
+                                    attachment['file_name'] != args.comments_file)
+print('Found', len(attachment_index), '`.%s` attachment files in' % args.attachment_extension, INPUT_DIRECTORY)
+if unmatched_attachment_files:
+    print('WARNING: found', len(unmatched_attachment_files), 'attachment files that do not match any recipient',
+          '(these will not be sent):', unmatched_attachment_files)
+
 recipient_count = 0
 recipient_total = len(message_recipient_json)
 for recipient in message_recipient_json:
@@ -189,15 +200,15 @@ for recipient in message_recipient_json:
         print(recipient['name'], '(%s)' % recipient_identifier)
 
     attachment_file = '%s.%s' % (recipient_identifier, args.attachment_extension)
-    attachment_path = os.path.join(INPUT_DIRECTORY, attachment_file)
-    attachment_mime_type = args.attachment_mime_type or mimetypes.guess_type(attachment_path)[0]
-    attachment_exists = os.path.exists(attachment_path)
+    attachment = attachment_index.get(recipient_identifier)
 
-    if attachment_exists and attachment_mime_type:
+    if attachment and attachment['mime_type']:
+        attachment_path = attachment['path']
+        attachment_mime_type = attachment['mime_type']
         print('Found conversation attachment file', attachment_file, 'with MIME type', attachment_mime_type)
     else:
-        print('Attachment %s at %s' % (attachment_file, os.path.dirname(attachment_path)),
-              'not found;' if not attachment_exists else 'is not of a recognised MIME type;',
+        print('Attachment %s at %s' % (attachment_file, INPUT_DIRECTORY),
+              'not found;' if not attachment else 'is not of a recognised MIME type;',
               'skipping upload for this submission')
         attachment_file = None
 
@@ -247,10 +258,9 @@ for recipient in message_recipient_json:
         file_submission_url_json = file_submission_url_response.json()
         print('\tUploading attachment to', file_submission_url_json['upload_url'].split('?')[0], '[truncated]')
 
-        files_data = {'file': (attachment_file, open(attachment_path, 'rb'))}
-        file_submission_upload_response = requests.post(file_submission_url_json['upload_url'],
-                                                        data=submission_form_data, files=files_data,
-                                                        headers=Utils.canvas_api_headers())
+        file_submission_upload_response = Utils.upload_file(file_submission_url_json['upload_url'],
+                                                            submission_form_data, attachment_file, attachment_path,
+                                                            mime_type=attachment_mime_type)
 
         if file_submission_upload_response.status_code != 201:  # note: 201 Created
             print('\tERROR: unable to upload attachment file; skipping recipient')
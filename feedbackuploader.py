@@ -5,19 +5,30 @@ lets you upload a set of attachments, feedback comments and marks in bulk."""
 __author__ = 'Simon Robinson'
 __copyright__ = 'Copyright (c) 2024 Simon Robinson'
 __license__ = 'Apache 2.0'
-__version__ = '2024-03-14'  # ISO 8601 (YYYY-MM-DD)
+__version__ = '2026-10-19'  # ISO 8601 (YYYY-MM-DD)
 
 import argparse
+import concurrent.futures
+import datetime
+import hashlib
 import json
-import mimetypes
 import os
 import sys
+import threading
+import time
 
 import requests
 
-from canvashelpers import Args, Config, Utils
+from canvashelpers import Args, Config, TransferProgress, Utils
 
 DEFAULT_COMMENT = 'See attached file'
+UPLOAD_MAX_WORKERS = 8  # students whose feedback is uploaded concurrently
+BULK_UPDATE_CHUNK_SIZE = 100  # students per `update_grades` request in `--bulk-update` mode
+BULK_UPDATE_INITIAL_DELAY = 1  # seconds between checks of bulk update progress; increases by 50% each time
+BULK_UPDATE_MAXIMUM_DELAY = 30
+BULK_UPDATE_MAXIMUM_CHECKS = 40  # progress checks (about 15 minutes) before a chunk is posted individually instead
+JOURNAL_FILE = 'feedbackuploader-journal.jsonl'  # saved in the assignment's input directory
+MARK_TOLERANCE = 0.001  # in `--changes-only` mode, marks that differ by less than this are treated as unchanged
 
 
 def get_args():
@@ -79,12 +90,196 @@ def get_args():
                         help='Delete all existing comments created by your Canvas user before adding any new feedback '
                              '(removing both manually-created comments and ones added via API scripts such as this '
                              'one). If comments have attachments, the attachments will also become inaccessible. Note '
-                             'that this option does not change any entered marks; only comments are removed.')
+                             'that this option does not change any entered marks; only comments are removed. '
+                             'Comments are deleted concurrently for all students before any new feedback is posted, '
+                             'unless `--delete-inline` is also set')
+    parser.add_argument('--delete-inline', action='store_true',
+                        help='Use this option *in addition* to `--delete-existing` to delete each student\'s (or '
+                             'group\'s) existing comments immediately before uploading their new feedback, rather '
+                             'than for all students first. This is faster for large classes, as deletions and uploads '
+                             'are handled at the same time')
+    parser.add_argument('--changes-only', action='store_true',
+                        help='Compare each submission\'s feedback with its current mark and the comments you have '
+                             'already added to it on Canvas, and post only the parts that differ. Marks that match '
+                             'the current mark are not re-posted, comments whose text you have already added are not '
+                             're-added, and attachments are not re-uploaded if one of your existing comments already '
+                             'has an attachment with the same name and size. This is useful when correcting a few '
+                             'entries in a large `--marks-file`. Cannot be combined with `--delete-existing`')
+    parser.add_argument('--bulk-update', action='store_true',
+                        help='Post marks and text comments for many students at once using Canvas\'s bulk grade '
+                             'update API (in batches of %d students), rather than sending one request per student. '
+                             'This is much faster for large classes. Submissions that have a feedback attachment are '
+                             'still uploaded individually' % BULK_UPDATE_CHUNK_SIZE)
+    parser.add_argument('--ignore-journal', action='store_true',
+                        help='Each piece of feedback that is successfully posted is recorded in a file named `%s` in '
+                             'the assignment\'s input directory, and re-running the script skips any submission whose '
+                             'feedback (attachment content, mark and comment) has already been posted. This means that '
+                             'an interrupted run can simply be restarted. Set this option to post all feedback again '
+                             'regardless (new entries are still added to the journal)' % JOURNAL_FILE)
     parser.add_argument('--dry-run', action='store_true',
                         help='Preview the script\'s actions without actually making any changes. Highly recommended!')
     return parser.parse_args()
 
 
+def get_journal_key(submitter, attachment_path, comment_association_data):
+    """Identify a piece of feedback by its recipient, the content of any attachment, and its mark and comment, so that
+    re-running the script with different feedback for the same submission is not mistaken for a repeat"""
+    journal_key = {'canvas_user_id': submitter['canvas_user_id'], 'feedback': comment_association_data,
+                   'attachment_sha256': Utils.get_file_sha256(attachment_path) if attachment_path else None}
+    return hashlib.sha256(json.dumps(journal_key, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def record_journal_entry(journal_key, submitter):
+    """Append a completed piece of feedback to the journal. Each entry is flushed to disk immediately so that the
+    journal is complete up to the point at which any crash occurs; a partially-written final line is ignored on
+    loading"""
+    journal_entry = {'key': journal_key, 'submitter': submitter,
+                     'completed_at': datetime.datetime.now(datetime.timezone.utc).isoformat()}
+    with journal_lock:
+        with open(JOURNAL_PATH, 'a') as journal_file:
+            journal_file.write(json.dumps(journal_entry) + '\n')
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+
+
+def load_journal():
+    completed_keys = set()
+    if os.path.exists(JOURNAL_PATH):
+        with open(JOURNAL_PATH) as journal_file:
+            for line in journal_file:
+                try:
+                    completed_keys.add(json.loads(line)['key'])
+                except (ValueError, KeyError):
+                    pass  # most likely a line that was interrupted while being written
+    return completed_keys
+
+
+def delete_comment(user_submission_url, comment):
+    comment_deletion_response = session.delete('%s/comments/%d' % (user_submission_url, comment['id']),
+                                               headers=Utils.canvas_api_headers())
+    if comment_deletion_response.status_code == 200:
+        print('\tDeleted existing submission comment:', comment)
+        return True
+    print('\tWARNING: unable to delete existing submission comment:', comment_deletion_response.text)
+    return False
+
+
+def upload_feedback(submitter, user_submission_url, attachment_file, attachment_path, attachment_mime_type,
+                    comment_association_data, journal_key):
+    """Upload one submission's feedback. The steps for each submission must happen in order (delete any existing
+    comments in `--delete-inline` mode, request an upload URL, upload the attachment, then post the comment/mark that
+    refers to it), but are independent of other submissions, so this function is run concurrently for several
+    submissions at once. Returns True on success"""
+    for comment in comment_deletions.pop(user_submission_url, []):
+        delete_comment(user_submission_url, comment)
+
+    feedback_identifier = submitter['group_name'] if args.groups else submitter['student_number']
+    if attachment_file:
+        # if there is an attachment we first need to request an upload URL, then associate with a submission comment
+        submission_form_data = {'name': attachment_file, 'content_type': attachment_mime_type}
+        file_submission_url_response = session.post('%s/comments/files' % user_submission_url,
+                                                     data=submission_form_data, headers=Utils.canvas_api_headers())
+        if file_submission_url_response.status_code != 200:
+            print('\tERROR: unable to retrieve attachment upload URL for', feedback_identifier, '- skipping submission')
+            return False
+
+        file_submission_url_json = file_submission_url_response.json()
+        print('\tUploading feedback attachment for', feedback_identifier, 'to',
+              file_submission_url_json['upload_url'].split('?')[0], '[truncated]')
+
+        file_submission_upload_response = Utils.upload_file(file_submission_url_json['upload_url'],
+                                                            submission_form_data, attachment_file, attachment_path,
+                                                            mime_type=attachment_mime_type, session=session,
+                                                            progress=upload_progress)
+
+        if file_submission_upload_response.status_code != 201:  # note: 201 Created
+            print('\tERROR: unable to upload attachment file for', feedback_identifier, '- skipping submission')
+            return False
+
+        file_submission_upload_json = file_submission_upload_response.json()
+        print('\tAssociating uploaded file', file_submission_upload_json['id'], 'with new attachment comment for',
+              feedback_identifier)
+        comment_association_data['comment[file_ids][]'] = [file_submission_upload_json['id']]
+
+    comment_association_response = session.put(user_submission_url, data=comment_association_data,
+                                               headers=Utils.canvas_api_headers())
+    if comment_association_response.status_code != 200:
+        print('\tERROR: unable to add assignment mark/comment and associate attachment for', feedback_identifier,
+              '- skipping submission')
+        return False
+
+    print('\tFeedback for', feedback_identifier, 'created and associated successfully at', user_submission_url)
+    if journal_key:  # (mark-only retries of bulk updates are not journalled; see post_bulk_updates)
+        record_journal_entry(journal_key, submitter)
+    if attachment_file:
+        upload_progress.add(completed_files=1)
+        print('\tAttachment upload progress:', upload_progress.status())
+    return True
+
+
+def post_bulk_updates(bulk_jobs):
+    """Post marks and comments for a list of (submitter, comment association data, journal key) tuples using the
+    `update_grades` API, in chunks of BULK_UPDATE_CHUNK_SIZE. Each request returns a Progress object, which is then
+    polled (up to BULK_UPDATE_MAXIMUM_CHECKS times) until Canvas has applied the changes. Completed chunks are recorded
+    in the journal. Returns a list of jobs to be retried individually: those whose chunk Canvas rejected outright, and,
+    for chunks that failed or did not complete in time (and so may have been partly applied), jobs that only re-post
+    the mark (which is safe to repeat, unlike comments) and have no journal key (as their comments may be missing)"""
+    # see: https://canvas.instructure.com/doc/api/submissions.html#method.submissions_api.bulk_update
+    failed_jobs = []
+    progress_urls = {}
+    for chunk_start in range(0, len(bulk_jobs), BULK_UPDATE_CHUNK_SIZE):
+        chunk = bulk_jobs[chunk_start:chunk_start + BULK_UPDATE_CHUNK_SIZE]
+        grade_data = {}
+        for submitter, comment_association_data, _ in chunk:
+            for key, value in comment_association_data.items():
+                # e.g., `submission[posted_grade]` becomes `grade_data[user_id][posted_grade]`
+                grade_data['grade_data[%d][%s]' % (submitter['canvas_user_id'], key.split('[')[1][:-1])] = value
+        bulk_update_response = requests.post('%s/submissions/update_grades' % ASSIGNMENT_URL, data=grade_data,
+                                             headers=Utils.canvas_api_headers())
+        if bulk_update_response.status_code != 200:
+            print('\tWARNING: unable to submit bulk update for', len(chunk), 'submissions (status code %d);' %
+                  bulk_update_response.status_code, 'these will be posted individually instead')
+            failed_jobs.extend(chunk)
+            continue
+        progress_urls[bulk_update_response.json()['url']] = (chunk, 0)
+        print('\tSubmitted bulk update for', len(chunk), 'submissions')
+
+    delay_time = BULK_UPDATE_INITIAL_DELAY
+    while progress_urls:
+        time.sleep(delay_time)
+        for progress_url, (chunk, check_count) in list(progress_urls.items()):
+            check_count += 1
+            progress_response = requests.get(progress_url, headers=Utils.canvas_api_headers())
+            progress_json = progress_response.json() if progress_response.status_code == 200 else {}
+            if progress_json.get('workflow_state') == 'completed':
+                print('\tBulk update completed for', len(chunk), 'submissions')
+                for submitter, _, journal_key in chunk:
+                    record_journal_entry(journal_key, submitter)
+            elif progress_json.get('workflow_state') == 'failed' or check_count >= BULK_UPDATE_MAXIMUM_CHECKS:
+                if progress_json.get('workflow_state') == 'failed':
+                    print('\tWARNING: bulk update failed for', len(chunk), 'submissions (%s)' %
+                          progress_json.get('message'), end='')
+                else:
+                    print('\tWARNING: bulk update of', len(chunk), 'submissions did not complete after', check_count,
+                          'progress checks', end='')
+                print('; marks will be re-posted individually, but comments are not re-sent because they may already '
+                      'have been added - please check the comments of:',
+                      [submitter['group_name' if args.groups else 'student_number'] for submitter, _, _ in chunk])
+                for submitter, comment_association_data, _ in chunk:
+                    if 'submission[posted_grade]' in comment_association_data:
+                        failed_jobs.append((submitter, {'submission[posted_grade]': comment_association_data[
+                            'submission[posted_grade]']}, None))
+            else:
+                if progress_json:
+                    print('\tWaiting for bulk update of', len(chunk), 'submissions (%s%% complete)' %
+                          progress_json.get('completion', 0))
+                progress_urls[progress_url] = (chunk, check_count)
+                continue
+            del progress_urls[progress_url]
+        delay_time = min(delay_time * 1.5, BULK_UPDATE_MAXIMUM_DELAY)
+    return failed_jobs
+
+
 args = Args.interactive(get_args)
 ASSIGNMENT_URL = Utils.course_url_to_api(args.url[0])
 assignment_id = Utils.get_assignment_id(ASSIGNMENT_URL)
@@ -98,6 +293,12 @@ if not os.path.exists(INPUT_DIRECTORY):
 print('%sUploading assignment feedback from %s to assignment %s' % (
     'DRY RUN: ' if args.dry_run else '', INPUT_DIRECTORY, args.url[0]))
 
+JOURNAL_PATH = os.path.join(INPUT_DIRECTORY, JOURNAL_FILE)
+journal_lock = threading.Lock()
+completed_journal_keys = set() if args.ignore_journal else load_journal()
+if completed_journal_keys:
+    print('Loaded', len(completed_journal_keys), 'completed feedback entries from', JOURNAL_PATH)
+
 marks_map = {}
 if args.marks_file:
     marks_file = os.path.join(INPUT_DIRECTORY, args.marks_file)
@@ -140,38 +341,50 @@ filtered_submission_list = Utils.filter_assignment_submissions(ASSIGNMENT_URL, s
                                                                include_unsubmitted=args.include_unsubmitted,
                                                                ignored_users=ignored_users, sort_entries=True)
 
-if args.delete_existing:
-    print('\nDeleting existing submission comments created by your Canvas user')
+if args.delete_existing or args.changes_only:
+    if args.delete_existing and args.changes_only:
+        print('ERROR: `--changes-only` cannot be used with `--delete-existing` (which removes existing feedback that '
+              'would otherwise be kept) - aborting')
+        sys.exit()
     SELF_ID, user_name = Utils.get_user_details(ASSIGNMENT_URL.split('/courses')[0], user_id='self')
     if not SELF_ID:
-        print('\tERROR: unable to retrieve your Canvas ID; aborting')
+        print('ERROR: unable to retrieve your Canvas ID; aborting')
         sys.exit()
 
+# existing comments to delete in `--delete-existing` mode, as {submission URL: [comments]}
+comment_deletions = {}
+if args.delete_existing:
     skipped_comments = 0
     for submission in filtered_submission_list:
-        if 'submission_comments' in submission:
-            for comment in submission['submission_comments']:
-                if comment['author_id'] != SELF_ID:
-                    skipped_comments += 1
-                    continue
-
-                if args.dry_run:
-                    print('\tDRY RUN: skipping deletion of existing comment:', comment)
-                    continue
-
-                comment_deletion_url = '%s/submissions/%d/comments/%d' % (
-                    ASSIGNMENT_URL, submission['user_id'], comment['id'])
-                comment_deletion_response = requests.delete(comment_deletion_url, headers=Utils.canvas_api_headers())
-                if comment_deletion_response.status_code == 200:
-                    print('\tDeleted existing submission comment:', comment)
-                else:
-                    print('\tWARNING: unable to delete existing submission comment:', comment_deletion_response.text)
+        for comment in submission.get('submission_comments', []):
+            if comment['author_id'] != SELF_ID:
+                skipped_comments += 1
+                continue
 
+            if args.dry_run:
+                print('DRY RUN: skipping deletion of existing comment:', comment)
+                continue
+
+            comment_deletions.setdefault('%s/submissions/%d' % (ASSIGNMENT_URL, submission['user_id']), []).append(
+                comment)
+
+    print('\nFound', sum(len(comments) for comments in comment_deletions.values()),
+          'existing submission comments created by your Canvas user to delete')
     if skipped_comments > 0:
-        print('\tSkipped deletion of', skipped_comments, 'existing comments created by other users')
+        print('Skipped deletion of', skipped_comments, 'existing comments created by other users')
+
+# attachments are matched against a single listing of the input directory rather than checked individually
+attachment_index = Utils.get_attachment_index(INPUT_DIRECTORY, args.attachment_extension,
+                                              mime_type=args.attachment_mime_type)
+print('\nFound', len(attachment_index), '`.%s` attachment files in' % args.attachment_extension, INPUT_DIRECTORY)
+matched_attachment_files = set()
 
 submission_count = 0
 submission_total = len(filtered_submission_list)
+upload_jobs = []
+bulk_jobs = []  # in `--bulk-update` mode, submissions that only need a mark and/or comment
+journal_skipped_count = 0
+unchanged_count = 0  # in `--changes-only` mode, submissions whose feedback matches what is already on Canvas
 for submission in filtered_submission_list:
     submission_count += 1
     submitter = Utils.get_submitter_details(ASSIGNMENT_URL, submission, groups_mode=args.groups)
@@ -184,37 +397,39 @@ for submission in filtered_submission_list:
 
     feedback_identifier = submitter['group_name'] if args.groups else submitter['student_number']
     attachment_file = '%s.%s' % (feedback_identifier, args.attachment_extension)
-    attachment_path = os.path.join(INPUT_DIRECTORY, attachment_file)
-    attachment_mime_type = args.attachment_mime_type or mimetypes.guess_type(attachment_path)[0]
-    attachment_exists = os.path.exists(attachment_path)
+    attachment = attachment_index.get(feedback_identifier)
 
     if args.groups and (submitter['group_name'] is None or feedback_identifier is None):
         # in `--include-unsubmitted` mode, submissions that have with no content of any form (document, comment, etc)
         print('WARNING: found group member with empty group name or ID')
 
-    if attachment_exists and attachment_mime_type:
-        print('Found submission attachment file', attachment_file, 'with MIME type', attachment_mime_type)
+    if attachment and attachment['mime_type']:
+        print('Found submission attachment file', attachment_file, 'with MIME type', attachment['mime_type'])
     elif args.groups and args.groups_individual:  # groups mode but with potential for individual feedback attachment
         attachment_file = '%s.%s' % (submitter['student_number'], args.attachment_extension)
-        attachment_path = os.path.join(INPUT_DIRECTORY, attachment_file)
-        attachment_mime_type = args.attachment_mime_type or mimetypes.guess_type(attachment_path)[0]
-        attachment_exists = os.path.exists(attachment_path)
+        attachment = attachment_index.get(submitter['student_number'])
 
-        if attachment_exists and attachment_mime_type:
+        if attachment and attachment['mime_type']:
             print('Found individual group member submission attachment file', attachment_file, 'with MIME type',
-                  attachment_mime_type)
+                  attachment['mime_type'])
         else:
             print('Both group %s' % ('(no group name found)' if not feedback_identifier else '(%s.%s)' % (
                 submitter['group_name'], args.attachment_extension)), 'and individual (%s)' % attachment_file,
-                  'attachment at %s' % os.path.dirname(attachment_path), 'were not found or are not of a recognised',
+                  'attachment at %s' % INPUT_DIRECTORY, 'were not found or are not of a recognised',
                   'MIME type; skipping upload for this submission')
             attachment_file = None
     else:
-        print('Attachment %s at %s' % (attachment_file, os.path.dirname(attachment_path)),
-              'not found;' if not attachment_exists else 'is not of a recognised MIME type;',
+        print('Attachment %s at %s' % (attachment_file, INPUT_DIRECTORY),
+              'not found;' if not attachment else 'is not of a recognised MIME type;',
               'skipping upload for this submission')
         attachment_file = None
 
+    attachment_path = attachment_mime_type = None
+    if attachment_file:
+        attachment_path = attachment['path']
+        attachment_mime_type = attachment['mime_type']
+        matched_attachment_files.add(attachment_file)
+
     # filter out unset fields, allowing any combination of mark/comment/attachment)
     attachment_comment = args.attachment_comment
     attachment_mark = None
@@ -245,6 +460,7 @@ for submission in filtered_submission_list:
         if attachment_file is None and attachment_comment == DEFAULT_COMMENT:
             print('Skipping default comment \'%s\' as no attachment is provided' % attachment_comment)
             del comment_association_data['comment[text_comment]']
+            comment_association_data.pop('comment[group_comment]', None)
         else:
             print('Using attachment comment provided as script argument:', attachment_comment)
 
@@ -254,42 +470,102 @@ for submission in filtered_submission_list:
             comment_association_data['submission[posted_grade]'] = '%s%%' % attachment_mark
         print('Adding submission mark from spreadsheet:', comment_association_data['submission[posted_grade]'])
 
-    if args.dry_run:
-        print('DRY RUN: skipping attachment upload and comment posting steps; moving to next submission')
-        continue
-
-    if attachment_file:
-        # if there is an attachment we first need to request an upload URL, then associate with a submission comment
-        submission_form_data = {'name': attachment_file, 'content_type': attachment_mime_type}
-        file_submission_url_response = requests.post('%s/comments/files' % user_submission_url,
-                                                     data=submission_form_data, headers=Utils.canvas_api_headers())
-        if file_submission_url_response.status_code != 200:
-            print('\tERROR: unable to retrieve attachment upload URL; skipping submission')
-            continue
-
-        file_submission_url_json = file_submission_url_response.json()
-        print('\tUploading feedback attachment to', file_submission_url_json['upload_url'].split('?')[0], '[truncated]')
-
-        files_data = {'file': (attachment_file, open(attachment_path, 'rb'))}
-        file_submission_upload_response = requests.post(file_submission_url_json['upload_url'],
-                                                        data=submission_form_data, files=files_data,
-                                                        headers=Utils.canvas_api_headers())
-
-        if file_submission_upload_response.status_code != 201:  # note: 201 Created
-            print('\tERROR: unable to upload attachment file; skipping submission')
+    if args.changes_only:
+        # compare against the submission's current mark and the comments (and attachments) you have already added
+        existing_comments = [comment for comment in submission.get('submission_comments', []) if
+                             comment['author_id'] == SELF_ID]
+        if attachment_file and any(attachment['display_name'] == attachment_file and
+                                   attachment['size'] == os.path.getsize(attachment_path) for comment in
+                                   existing_comments for attachment in comment.get('attachments', [])):
+            print('Attachment', attachment_file, 'has already been uploaded; skipping attachment')
+            attachment_file = attachment_path = attachment_mime_type = None
+            if comment_association_data.get('comment[text_comment]') == DEFAULT_COMMENT:
+                del comment_association_data['comment[text_comment]']
+                comment_association_data.pop('comment[group_comment]', None)
+        if not attachment_file and 'comment[text_comment]' in comment_association_data and \
+                comment_association_data['comment[text_comment]'].strip() in [
+                    comment['comment'].strip() for comment in existing_comments]:
+            print('Comment has already been added; skipping comment')
+            del comment_association_data['comment[text_comment]']
+            comment_association_data.pop('comment[group_comment]', None)
+        if attachment_mark is not None and submission.get('score') is not None:
+            expected_score = attachment_mark * maximum_marks / 100 if args.marks_as_percentage else attachment_mark
+            if abs(submission['score'] - expected_score) < MARK_TOLERANCE:
+                print('Mark is unchanged from current value', submission['score'], '- skipping mark')
+                del comment_association_data['submission[posted_grade]']
+        if not attachment_file and not comment_association_data:
+            print('Feedback is unchanged; skipping submission')
+            unchanged_count += 1
             continue
 
-        file_submission_upload_json = file_submission_upload_response.json()
-        print('\tAssociating uploaded file', file_submission_upload_json['id'], 'with new attachment comment')
-        comment_association_data['comment[file_ids][]'] = [file_submission_upload_json['id']]
+    journal_key = get_journal_key(submitter, attachment_path, comment_association_data)
+    if journal_key in completed_journal_keys:
+        print('Skipping submission - this feedback has already been posted (see %s)' % JOURNAL_FILE)
+        comment_deletions.pop(user_submission_url, None)  # any existing comments were removed when it was posted
+        journal_skipped_count += 1
+        continue
 
-    comment_association_response = requests.put(user_submission_url, data=comment_association_data,
-                                                headers=Utils.canvas_api_headers())
-    if comment_association_response.status_code != 200:
-        print('\tERROR: unable to add assignment mark/comment and associate attachment; skipping submission')
+    if args.dry_run:
+        print('DRY RUN: skipping attachment upload and comment posting steps; moving to next submission')
         continue
 
-    print('\tFeedback created and associated successfully at', user_submission_url)
+    # uploads are started once all submissions have been checked (see below)
+    if args.bulk_update and not attachment_file:
+        if comment_association_data:
+            bulk_jobs.append((submitter, comment_association_data, journal_key))
+        continue
+    upload_jobs.append((submitter, user_submission_url, attachment_file, attachment_path, attachment_mime_type,
+                        comment_association_data, journal_key))
+
+if journal_skipped_count > 0:
+    print('\nSkipped', journal_skipped_count, 'submissions whose feedback has already been posted')
+if unchanged_count > 0:
+    print('\nSkipped', unchanged_count, 'submissions whose feedback is unchanged from that on Canvas')
+
+unmatched_attachment_files = sorted(attachment['file_name'] for attachment in attachment_index.values() if
+                                    attachment['file_name'] not in matched_attachment_files and
+                                    attachment['file_name'] != args.marks_file)
+if unmatched_attachment_files:
+    print('\nWARNING: found', len(unmatched_attachment_files), 'attachment files that do not match any submission',
+          '(these will not be uploaded):', unmatched_attachment_files)
+
+session = requests.Session()
+if comment_deletions and not args.delete_inline:
+    # all existing comments are deleted before any new feedback is posted
+    deletion_jobs = [(url, comment) for url, comments in comment_deletions.items() for comment in comments]
+    comment_deletions = {}
+    print('\nDeleting', len(deletion_jobs), 'existing submission comments created by your Canvas user')
+    with concurrent.futures.ThreadPoolExecutor(max_workers=UPLOAD_MAX_WORKERS) as executor:
+        deleted_count = sum(executor.map(lambda job: delete_comment(*job), deletion_jobs))
+    print('Deleted', deleted_count, 'of', len(deletion_jobs), 'existing submission comments')
+
+if bulk_jobs:
+    print('\nPosting marks and comments for', len(bulk_jobs), 'submissions without attachments in bulk')
+    for submitter, comment_association_data, journal_key in post_bulk_updates(bulk_jobs):
+        upload_jobs.append((submitter, '%s/submissions/%d' % (ASSIGNMENT_URL, submitter['canvas_user_id']), None, None,
+                            None, comment_association_data, journal_key))
+
+if upload_jobs or comment_deletions:
+    attachment_paths = [job[3] for job in upload_jobs if job[3]]
+    upload_progress = TransferProgress(sum(os.path.getsize(path) for path in attachment_paths), len(attachment_paths))
+    print('\nUploading feedback for', len(upload_jobs), 'submissions (%d attachments; %s)' % (
+        len(attachment_paths), TransferProgress.format_bytes(upload_progress.total_bytes)))
+
+    # in `--delete-inline` mode, each upload job first deletes its own submission's existing comments; those of any
+    # submissions that are not receiving new feedback via an upload job are deleted alongside the uploads
+    upload_urls = set(job[1] for job in upload_jobs)
+    deletion_jobs = [(url, comment) for url in list(comment_deletions) if url not in upload_urls for comment in
+                     comment_deletions.pop(url)]
+    upload_failures = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=UPLOAD_MAX_WORKERS) as executor:
+        for job in deletion_jobs:
+            executor.submit(delete_comment, *job)
+        for upload_succeeded in executor.map(lambda job: upload_feedback(*job), upload_jobs):
+            if not upload_succeeded:
+                upload_failures += 1
+    print('Uploaded feedback for', len(upload_jobs) - upload_failures, 'of', len(upload_jobs), 'submissions')
+    if upload_failures > 0:
+        print('WARNING:', upload_failures, 'feedback uploads failed - see above for details')
 
 for key, entry in marks_map.items():
     if 'matched' not in entry:
@@ -25,18 +25,16 @@ Related tools:
 __author__ = 'Simon Robinson'
 __copyright__ = 'Copyright (c) 2024 Simon Robinson'
 __license__ = 'Apache 2.0'
-__version__ = '2023-08-03'  # ISO 8601 (YYYY-MM-DD)
+__version__ = '2026-10-19'  # ISO 8601 (YYYY-MM-DD)
 
 import argparse
 import json
 import os
 import sys
 
-import openpyxl.utils
-import openpyxl.worksheet.dimensions
 import requests
 
-from canvashelpers import Args, Config, Utils
+from canvashelpers import Args, Config, SpreadsheetWriter, Utils
 
 
 def get_args():
@@ -115,9 +113,10 @@ print('Configuring moderated assignment', ASSIGNMENT_ID, ('(with rubric)' if HAS
 # get details of the rubric - its points, criteria and link with the assignment
 rubric = []
 rubric_association = None
-rubric_spreadsheet_map = {}
 rubric_points_hidden = False
 spreadsheet_headers = ['Student Number', 'Student Name', 'Marker ID', 'Marker Name', 'Overall Mark']  # backup only
+spreadsheet_keys = ['student_number', 'student_name', 'marker_id', 'marker_name', 'overall_mark']
+spreadsheet_column_widths = [len(header) for header in spreadsheet_headers]
 if HAS_RUBRIC:
     rubric_id = assignment_details_json['rubric_settings']['id']
     print('Found rubric', rubric_id, 'associated with assignment', ASSIGNMENT_ID)
@@ -133,9 +132,11 @@ if HAS_RUBRIC:
     rubric_associations_json = rubric_associations_response.json()
     for criterion in rubric_associations_json['data']:
         rubric.append({'id': criterion['id'], 'points': criterion['points'], 'description': criterion['description']})
-        spreadsheet_headers.extend(['', 'Rubric: %s (max: %s; ID: %s)' % (criterion['description'], criterion['points'],
-                                                                          criterion['id'])])  # '' to allow merging
-        rubric_spreadsheet_map[criterion['id']] = len(spreadsheet_headers)
+        criterion_header = 'Rubric: %s (max: %s; ID: %s)' % (criterion['description'], criterion['points'],
+                                                              criterion['id'])
+        spreadsheet_headers.extend([criterion_header, criterion_header])  # merged across points and comments columns
+        spreadsheet_keys.extend(['points_%s' % criterion['id'], 'comments_%s' % criterion['id']])
+        spreadsheet_column_widths.extend([0, len(criterion_header)])
 
     # get the connection between assignment and rubric (the association)
     for association in rubric_associations_json['associations']:
@@ -151,23 +152,12 @@ if HAS_RUBRIC:
     print('Found rubric association', rubric_association['id'], '(points hidden: %s) -' % rubric_points_hidden,
           rubric_association)
 
-# moderation of marks involves irreversible changes, so we back up the current state to a spreadsheet
-workbook = openpyxl.Workbook()
-spreadsheet = workbook.active
-spreadsheet.title = 'Moderated marks (%d)' % ASSIGNMENT_ID
-spreadsheet.freeze_panes = 'A2'  # set the first row as a header
-spreadsheet.append(spreadsheet_headers)
-
-dimension_holder = openpyxl.worksheet.dimensions.DimensionHolder(worksheet=spreadsheet)
-for column in range(spreadsheet.min_column, spreadsheet.max_column + 1):  # try to size columns appropriately
-    column_dimension = openpyxl.worksheet.dimensions.ColumnDimension(spreadsheet, min=column, max=column,
-                                                                     width=len(spreadsheet_headers[column - 1]))
-    dimension_holder[openpyxl.utils.get_column_letter(column)] = column_dimension  # stackoverflow.com/a/60801712
-spreadsheet.column_dimensions = dimension_holder
-header_row = spreadsheet.max_row
-for column in rubric_spreadsheet_map.values():
-    spreadsheet.cell(row=header_row, column=column - 1).value = spreadsheet.cell(row=header_row, column=column).value
-    spreadsheet.merge_cells(start_row=header_row, end_row=header_row, start_column=column - 1, end_column=column)
+# moderation of marks involves irreversible changes, so we back up the current state to a spreadsheet (with each rubric
+# criterion's header merged across its points and comments columns, and columns sized to fit their headers)
+spreadsheet = SpreadsheetWriter(args.backup_file, spreadsheet_headers, title='Moderated marks (%d)' % ASSIGNMENT_ID,
+                                column_keys=spreadsheet_keys, column_widths=spreadsheet_column_widths)
+for column in range(len(spreadsheet_headers) - 2 * len(rubric) + 1, len(spreadsheet_headers), 2):
+    spreadsheet.merge_header_cells(column, column + 1)
 
 # next, load the assignment's submissions as normal, but combine and average existing comments/scores
 submission_list_response = Utils.get_assignment_submissions(ASSIGNMENT_URL,
@@ -237,8 +227,8 @@ for submission in filtered_submission_list:
         if scorer_id not in user_map:
             _, scorer_name = Utils.get_user_details(API_ROOT, scorer_id)
             user_map[scorer_id] = scorer_name
-        spreadsheet.append([submitter['student_number'], submitter['student_name'],
-                            scorer_id, user_map[scorer_id], overall_score])
+        backup_row = {'student_number': submitter['student_number'], 'student_name': submitter['student_name'],
+                      'marker_id': scorer_id, 'marker_name': user_map[scorer_id], 'overall_mark': overall_score}
 
         # submissions with rubrics need a little more unpacking to get the individual points and comments
         print('\tFound provisional grade from', user_map[scorer_id], scorer_grade)
@@ -247,6 +237,7 @@ for submission in filtered_submission_list:
                 # an overall assessment score has been entered, but no rubric details - often this is a submission given
                 # 0 where there was no need to complete the rubric (e.g., absent); best to highlight for manual checking
                 print('\t\tWARNING: skipping provisional grade from', user_map[scorer_id], 'with no rubric assessment')
+                spreadsheet.append(backup_row)
                 continue
 
             rubric_assessment = scorer_grade['rubric_assessments'][0]  # safe: there is only one assessment per marker
@@ -256,22 +247,22 @@ for submission in filtered_submission_list:
             rubric_score = rubric_assessment['score']
             if rubric_score is None and not rubric_points_hidden:  # can be none if the marker/moderator has not marked
                 print('\t\tWARNING: skipping rubric assessment from', user_map[scorer_id], 'with no score entered')
+                spreadsheet.append(backup_row)
                 continue
 
-            row = spreadsheet.max_row
             for criterion in rubric_assessment['data']:
                 criterion_id = criterion['criterion_id']
 
                 # add rubric details to our backup spreadsheet, then build them into the final rubric (even if we have
                 # overridden these points in the final mark calculation)
-                position = rubric_spreadsheet_map[criterion_id]
                 if 'points' in criterion:
-                    spreadsheet['%s%d' % (openpyxl.utils.get_column_letter(position - 1), row)] = criterion['points']
+                    backup_row['points_%s' % criterion_id] = criterion['points']
                     rubric_points[criterion_id].append(criterion['points'])
                 if criterion['comments_enabled'] and criterion['comments']:
-                    spreadsheet['%s%d' % (openpyxl.utils.get_column_letter(position), row)] = criterion['comments']
+                    backup_row['comments_%s' % criterion_id] = criterion['comments']
                     scorer_identity = '%s: ' % user_map[scorer_id] if args.identify_rubric_markers else ''
                     rubric_comments[criterion_id].append('%s%s' % (scorer_identity, criterion['comments']))
+            spreadsheet.append(backup_row)
 
             if moderator_override:
                 continue  # we've already overridden this mark - back it up, but don't include it in the calculation
@@ -296,6 +287,7 @@ for submission in filtered_submission_list:
                 # break  # don't just exit - we want to back up other marks even if they are not taken into account
 
         else:
+            spreadsheet.append(backup_row)
             if moderator_override:
                 continue  # we've already overridden this mark - back it up, but don't include it in the calculation
 
@@ -336,28 +328,28 @@ for submission in filtered_submission_list:
 
     print('\t%s a final mark of' % ('DRY RUN: would post' if args.dry_run else 'Posting'), submitter_final_grade, 'for',
           submitter['student_number'], '- rubric: %s, %s' % (rubric_points, rubric_comments) if HAS_RUBRIC else '')
-    spreadsheet.append([submitter['student_number'], submitter['student_name'], '-1', os.path.basename(__file__),
-                        submitter_final_grade])
-
-    if HAS_RUBRIC:
+    backup_row = {'student_number': submitter['student_number'], 'student_name': submitter['student_name'],
+                  'marker_id': '-1', 'marker_name': os.path.basename(__file__), 'overall_mark': submitter_final_grade}
+    if not HAS_RUBRIC:
+        spreadsheet.append(backup_row)
+    else:
         # add a new additional rubric as a summary of the individual markers' comments and scores
         new_provisional_grade_data = {'rubric_assessment[user_id]': submitter['canvas_user_id'],
                                       'rubric_assessment[assessment_type]': 'grading',
                                       # 'graded_anonymously': True,  # grading anonymously seem to do nothing in reality
                                       'provisional': True, 'final': True}  # provisional+final generates a new rubric
 
-        row = spreadsheet.max_row
         for rubric_criterion in rubric:  # collate points/comments and add details to our backup spreadsheet
             points = rubric_points[rubric_criterion['id']]
-            position = rubric_spreadsheet_map[rubric_criterion['id']]
             criteria_index = 'rubric_assessment[criterion_%s]' % rubric_criterion['id']
             if len(points) > 0:
                 average_points = sum(points) / len(points)
                 new_provisional_grade_data['%s[points]' % criteria_index] = average_points
-                spreadsheet['%s%d' % (openpyxl.utils.get_column_letter(position - 1), row)] = average_points
+                backup_row['points_%s' % rubric_criterion['id']] = average_points
             comments = rubric_comments[rubric_criterion['id']]
             new_provisional_grade_data['%s[comments]' % criteria_index] = '\n\n---\n\n'.join(comments)
-            spreadsheet['%s%d' % (openpyxl.utils.get_column_letter(position), row)] = '\n\n---\n\n'.join(comments)
+            backup_row['comments_%s' % rubric_criterion['id']] = '\n\n---\n\n'.join(comments)
+        spreadsheet.append(backup_row)
 
         if args.dry_run:
             continue
@@ -389,7 +381,7 @@ for submission in filtered_submission_list:
             skipped_submissions.add(submitter['student_name'])
             continue
 
-workbook.save(args.backup_file)
+spreadsheet.close()
 if args.dry_run:
     print('\nDRY RUN: exiting without releasing grades')
     sys.exit()
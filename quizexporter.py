@@ -8,7 +8,7 @@ limitation, exporting all responses to a single spreadsheet."""
 __author__ = 'Simon Robinson'
 __copyright__ = 'Copyright (c) 2024 Simon Robinson'
 __license__ = 'Apache 2.0'
-__version__ = '2024-04-17'  # ISO 8601 (YYYY-MM-DD)
+__version__ = '2026-10-19'  # ISO 8601 (YYYY-MM-DD)
 
 import argparse
 import json
@@ -16,10 +16,9 @@ import os
 import re
 import sys
 
-import openpyxl.utils
 import requests.structures
 
-from canvashelpers import Args, Config, Utils
+from canvashelpers import Args, Config, SpreadsheetWriter, Utils
 
 
 def get_args():
@@ -62,13 +61,10 @@ print('Exporting quiz results from assignment', args.url[0], 'to', OUTPUT_FILE)
 HTML_REGEX = re.compile('<.*?>')  # used to filter out HTML formatting from retrieved responses
 
 # TODO: add CSV export as an alternative (with care to handle multi-line values)
-workbook = openpyxl.Workbook()
-spreadsheet = workbook.active
-spreadsheet.title = 'Quiz results (%d)' % ASSIGNMENT_ID
-spreadsheet.freeze_panes = 'A2'  # set the first row as a header
+# rows are streamed to the output file; headers are written once the first submission's questions are known
+spreadsheet = SpreadsheetWriter(OUTPUT_FILE, title='Quiz results (%d)' % ASSIGNMENT_ID)
 spreadsheet_headers = ['Student number', 'Student name']
-spreadsheet_headers_set = False
-spreadsheet_row = 2  # 1-indexed; row 1 = headers
+spreadsheet_keys = ['student_number', 'student_name']  # question titles may not be unique, so we index by question ID
 
 submission_list_response = Utils.get_assignment_submissions(ASSIGNMENT_URL)
 if not submission_list_response:
@@ -131,8 +127,8 @@ for user_session_id in user_session_ids:
     results_id = submission_summary_json['authoritative_result']['id']
     student_name = submission_summary_json['metadata']['user_full_name']
     student_details = [s for s in student_number_map if s['user_id'] == user_session_id['user_id']]
-    spreadsheet['A%d' % spreadsheet_row] = student_details[0]['student_number'] if len(student_details) == 1 else '-1'
-    spreadsheet['B%d' % spreadsheet_row] = student_name
+    response_row = {'student_number': student_details[0]['student_number'] if len(student_details) == 1 else '-1',
+                    'student_name': student_name}
     print('Loaded submission summary for', student_name, '-', results_id)
 
     # then the actual quiz questions
@@ -146,14 +142,14 @@ for user_session_id in user_session_ids:
         headers=quiz_session_headers)
     quiz_answers_json = quiz_answers_response.json()
 
-    current_column = 3  # in our spreadsheet, column 1 is always the student's number; column 2 is always their name
     for question in quiz_questions_json:
         question_id = question['item']['id']
         question_type = question['item']['user_response_type']
         question_title = question['item']['title']
 
-        if not spreadsheet_headers_set:
+        if not spreadsheet.headers:
             spreadsheet_headers.append(question_title)
+            spreadsheet_keys.append(question_id)
 
         print()
         print(question_title)
@@ -177,8 +173,7 @@ for user_session_id in user_session_ids:
                         answer_text = re.sub(HTML_REGEX, '', raw_answer)
 
                     print(answer_text)
-                    spreadsheet[
-                        '%s%d' % (openpyxl.utils.get_column_letter(current_column), spreadsheet_row)] = answer_text
+                    response_row[question_id] = answer_text
                 else:
                     print('ERROR: no response value found for', question_type, 'question', question_id)
 
@@ -186,8 +181,7 @@ for user_session_id in user_session_ids:
                 for value in current_answer['scored_data']['value']:
                     if current_answer['scored_data']['value'][value]['user_responded']:
                         print(value)
-                        spreadsheet[
-                            '%s%d' % (openpyxl.utils.get_column_letter(current_column), spreadsheet_row)] = value
+                        response_row[question_id] = value
                         break
 
             elif question_type == 'Uuid' or question_type == 'MultipleUuid':
@@ -209,12 +203,10 @@ for user_session_id in user_session_ids:
                 if len(answer_parts) > 0:
                     answer_text = ', '.join(answer_parts)
                     print(answer_text)
-                    spreadsheet['%s%d' % (
-                        openpyxl.utils.get_column_letter(current_column), spreadsheet_row)] = answer_text
+                    response_row[question_id] = answer_text
                 else:
                     print('ERROR: no response value found for', question_type, 'question', question_id)
-                    spreadsheet['%s%d' % (
-                        openpyxl.utils.get_column_letter(current_column), spreadsheet_row)] = ''
+                    response_row[question_id] = ''
 
             elif question_type == 'MultipleResponse':
                 # (note that choice lists are unhelpfully stored in a range of different formats/structures...)
@@ -232,20 +224,16 @@ for user_session_id in user_session_ids:
                 if len(answer_parts) > 0:
                     answer_text = ', '.join(answer_parts)
                     print(answer_text)
-                    spreadsheet['%s%d' % (
-                        openpyxl.utils.get_column_letter(current_column), spreadsheet_row)] = answer_text
+                    response_row[question_id] = answer_text
                 elif skip_question_type:
                     # TODO: this should really be separate columns for each category, but the way New Quizzes are set
                     #       up means we don't see which incorrect items were associated with which categories
                     print('WARNING: quiz response type MultipleResponse (Categorisation) not currently handled -',
                           'skipping')
-                    spreadsheet['%s%d' % (
-                        openpyxl.utils.get_column_letter(current_column),
-                        spreadsheet_row)] = 'DATA MISSING - NOT YET EXPORTED'
+                    response_row[question_id] = 'DATA MISSING - NOT YET EXPORTED'
                 else:
                     print('ERROR: no response value found for', question_type, 'question', question_id)
-                    spreadsheet['%s%d' % (
-                        openpyxl.utils.get_column_letter(current_column), spreadsheet_row)] = ''
+                    response_row[question_id] = ''
 
             elif question_type == 'Hash' or question_type == 'HashOfTexts':
                 # TODO: we don't fully handle Hash (hot spot) or HashOfTexts (matching) questions because they are easy
@@ -255,24 +243,19 @@ for user_session_id in user_session_ids:
                 response_summary = 'Correct response: %s' % ('true' if current_answer['scored_data'][
                     'correct'] else 'false')
                 print(response_summary)
-                spreadsheet[
-                    '%s%d' % (openpyxl.utils.get_column_letter(current_column), spreadsheet_row)] = response_summary
+                response_row[question_id] = response_summary
 
             else:
                 # TODO: handle any other response types
                 print('WARNING: quiz response type', question_type, 'not currently handled - skipping')
-                spreadsheet['%s%d' % (
-                    openpyxl.utils.get_column_letter(current_column),
-                    spreadsheet_row)] = 'DATA MISSING - NOT YET EXPORTED'
+                response_row[question_id] = 'DATA MISSING - NOT YET EXPORTED'
 
-            current_column += 1
+    if not spreadsheet.headers:
+        spreadsheet.write_headers(spreadsheet_headers, column_keys=spreadsheet_keys)
+    for question_id in [k for k in response_row if k not in spreadsheet.column_index]:
+        print('WARNING: skipping response to question', question_id, 'that was not present in the first submission')
+        del response_row[question_id]
+    spreadsheet.append(response_row)
 
-    if not spreadsheet_headers_set:
-        for header_number in range(1, len(spreadsheet_headers) + 1):  # spreadsheet indexes are 1-based
-            column_letter = openpyxl.utils.get_column_letter(header_number)
-            spreadsheet['%s1' % column_letter] = spreadsheet_headers[header_number - 1]
-        spreadsheet_headers_set = True
-    spreadsheet_row += 1
-
-workbook.save(OUTPUT_FILE)
-print('\nSaved', (spreadsheet_row - 2), 'quiz responses to', OUTPUT_FILE)
+spreadsheet.close()
+print('\nSaved', spreadsheet.row_count, 'quiz responses to', OUTPUT_FILE)
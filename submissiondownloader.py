@@ -5,26 +5,41 @@ institutional student number) or group name."""
 __author__ = 'Simon Robinson'
 __copyright__ = 'Copyright (c) 2024 Simon Robinson'
 __license__ = 'Apache 2.0'
-__version__ = '2023-10-04'  # ISO 8601 (YYYY-MM-DD)
+__version__ = '2026-10-19'  # ISO 8601 (YYYY-MM-DD)
 
 import argparse
 import concurrent.futures
-import csv
 import datetime
 import functools
+import hashlib
+import heapq
 import json
 import os
 import re
-import sys
+import shutil
 import time
+import zipfile
 
-import openpyxl.utils
 import requests
 
-from canvashelpers import Args, Config, Utils
+from canvashelpers import Args, Config, SpreadsheetWriter, TransferProgress, Utils
 
+TURNITIN_MAX_WORKERS = 8  # concurrent requests to the Turnitin server when queuing, polling and downloading reports
+TURNITIN_INITIAL_DELAY = 0.5  # seconds before a queued report is first polled; increases by 50% for each retry
+TURNITIN_MAXIMUM_DELAY = 30  # upper limit for the (per-report) delay between status checks
+TURNITIN_MAXIMUM_CHECKS = 60  # status checks per report before giving up (about 25 minutes at the maximum delay)
+BULK_ARCHIVE_INITIAL_DELAY = 2  # seconds between checks of the submissions archive status; increases by 50% each time
+BULK_ARCHIVE_MAXIMUM_DELAY = 30
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024  # bytes
+DOWNLOAD_MAX_WORKERS = 8  # concurrent submission attachment downloads
+PROGRESS_INTERVAL = 5  # maximum number of seconds between download progress updates
+EXTRACT_MAX_TOTAL_BYTES = 2 * 1024 * 1024 * 1024  # limits used to refuse suspicious archives in `--extract-archives`
+EXTRACT_MAX_FILES = 10000
+EXTRACT_MAX_COMPRESSION_RATIO = 200
+METADATA_INDEX_FILE = 'index.jsonl'
 
-def get_args():
+
+def get_args(argv=None):
     parser = argparse.ArgumentParser()
     parser.add_argument('url', nargs=1,
                         help='Please provide the URL of the assignment to download submissions for. Files will be '
@@ -58,49 +73,33 @@ def get_args():
                              'submission, named as the student\'s number or the group\'s name. The original filename '
                              'will be used for each attachment that is downloaded. Without this option, any additional '
                              'attachments will be ignored, and only the first file found will be downloaded')
-    return parser.parse_args()
-
-
-args = Args.interactive(get_args)
-ASSIGNMENT_URL = Utils.course_url_to_api(args.url[0])
-ASSIGNMENT_ID = Utils.get_assignment_id(ASSIGNMENT_URL)  # used only for output directory
-working_directory = os.path.dirname(
-    os.path.realpath(__file__)) if args.working_directory is None else args.working_directory
-os.makedirs(working_directory, exist_ok=True)
-OUTPUT_DIRECTORY = '%s/%d' % (working_directory, ASSIGNMENT_ID)
-if os.path.exists(OUTPUT_DIRECTORY):
-    print('ERROR: assignment output directory', OUTPUT_DIRECTORY, 'already exists - please remove or rename')
-    sys.exit()
-os.mkdir(OUTPUT_DIRECTORY)
-
-assignment_details_response = requests.get(ASSIGNMENT_URL, headers=Utils.canvas_api_headers())
-if assignment_details_response.status_code != 200:
-    print('ERROR: unable to get assignment details - did you set a valid Canvas API token in %s?' % Config.FILE_PATH)
-    sys.exit()
-GROUP_ASSIGNMENT = True if assignment_details_response.json()['group_category_id'] else False
-print('Retrieved assignment details - group assignment:', GROUP_ASSIGNMENT)
-
-speedgrader_file = None
-speedgrader_output = []
-if args.speedgrader_file and args.speedgrader_file.lower() in ['xlsx', 'csv']:
-    speedgrader_file = '%s/speedgrader.%s' % (OUTPUT_DIRECTORY, args.speedgrader_file.lower())
-    print('Creating a course roster file with SpeedGrader links from', args.url[0], 'at', speedgrader_file)
-else:
-    output_format = '[student number].[uploaded file extension]'
-    if GROUP_ASSIGNMENT:
-        output_format = '[group name].[uploaded file extension]'
-    if args.multiple_attachments:
-        output_format = '[group name]/[original uploaded filename]'
-    print('Downloading all submission documents from', args.url[0], 'named as', output_format, 'to', OUTPUT_DIRECTORY)
-
-submission_list_response = Utils.get_assignment_submissions(ASSIGNMENT_URL)
-if not submission_list_response:
-    print('ERROR: unable to retrieve submission list - did you set a valid Canvas API token in %s?' % Config.FILE_PATH)
-    sys.exit()
-
-submission_list_json = json.loads(submission_list_response)
-filtered_submission_list = Utils.filter_assignment_submissions(ASSIGNMENT_URL, submission_list_json,
-                                                               groups_mode=GROUP_ASSIGNMENT, sort_entries=True)
+    parser.add_argument('--bulk-archive', action='store_true',
+                        help='Rather than requesting each attachment individually, ask Canvas to compile its own '
+                             '"Download Submissions" zip file for the assignment, then download this single archive '
+                             'and rename its contents locally. This requires far fewer requests for large classes, but '
+                             'Canvas can take a while to prepare the archive. Has no effect in `--speedgrader-file` or '
+                             '`--turnitin-pdf-session-id` modes')
+    parser.add_argument('--all-attempts', action='store_true',
+                        help='Download every submission attempt rather than just the latest one (useful for academic '
+                             'integrity reviews). Each attempt is saved in its own subfolder, named as [student number '
+                             'or group name]/[attempt number], using the original filename of each attachment. In '
+                             'this mode an existing output folder is reused, and any attachments that have already '
+                             'been downloaded are skipped, so re-running the script only retrieves new attempts. '
+                             'Takes precedence over `--multiple-attachments` and `--bulk-archive`')
+    parser.add_argument('--extract-archives', action='store_true',
+                        help='Extract any zip file attachments into a folder alongside the downloaded file, named the '
+                             'same as the archive without its extension (e.g., [student number].zip is extracted into '
+                             '[student number]/). Extraction runs in parallel with the remaining downloads. Archives '
+                             'that would expand to an unreasonable size or number of files, or that contain unsafe '
+                             'paths, are left unextracted. In `--bulk-archive` mode, extraction happens once the '
+                             'submissions archive has been renamed')
+    parser.add_argument('--metadata-index', action='store_true',
+                        help='Save a file named `%s` in the output folder alongside the downloaded attachments. '
+                             'Each line of this file is a JSON object describing one submission: the submitter\'s '
+                             'details and Canvas IDs, lateness, Turnitin ID, SpeedGrader link, and the ID, size, '
+                             'SHA-256 hash and local path of each attachment. This allows other tools to look up '
+                             'submission details without further API requests' % METADATA_INDEX_FILE)
+    return parser.parse_args(argv)
 
 
 def compare_attachment_dates(a1, a2):
@@ -109,186 +108,668 @@ def compare_attachment_dates(a1, a2):
     return a2_created - a1_created  # sort in descending order of creation date
 
 
-def filter_matched_submissions(single_submission):
-    submitter_details = Utils.get_submitter_details(ASSIGNMENT_URL, single_submission, groups_mode=GROUP_ASSIGNMENT)
-    if GROUP_ASSIGNMENT:
-        return submitter_matcher.match(submitter_details['group_name'])
-    return submitter_matcher.match(submitter_details['student_number']) or submitter_matcher.match(
-        submitter_details['student_name'])
-
-
 def get_turnitin_id(single_submission):
-    if 'turnitin_data' in single_submission:
-        turnitin_data = list(submission['turnitin_data'].values())[0]
-        return turnitin_data['outcome_response']['paperid']
+    """Return the Turnitin paper ID of a submission, or an empty string if there is none. Entries in `turnitin_data` can
+    have other shapes (e.g., pending reports, or Canvas Plagiarism Framework data without an `outcome_response`)"""
+    turnitin_data = single_submission.get('turnitin_data')
+    if not isinstance(turnitin_data, dict):
+        return ''
+    for turnitin_entry in turnitin_data.values():
+        outcome_response = turnitin_entry.get('outcome_response') if isinstance(turnitin_entry, dict) else None
+        if isinstance(outcome_response, dict) and outcome_response.get('paperid'):
+            return outcome_response['paperid']
     return ''
 
 
-submitter_matcher = None
-if args.submitter_pattern:
-    submitter_matcher = re.compile(args.submitter_pattern, flags=re.IGNORECASE)
-    matched_submissions = list(filter(filter_matched_submissions, filtered_submission_list))
-    print('Filtered', len(filtered_submission_list), 'valid submissions using pattern "%s"' % args.submitter_pattern,
-          '-', len(matched_submissions), 'valid submissions remaining')
-    filtered_submission_list = matched_submissions
-
-turnitin_links_present = False
-turnitin_report_downloads = {}
-turnitin_session_cookie = None
-if args.turnitin_pdf_session_id:
-    turnitin_session_cookie = {'cookie': 'session-id=%s' % args.turnitin_pdf_session_id}
-
-download_count = 0
-download_total = len(filtered_submission_list)
-for submission in filtered_submission_list:
-    download_count += 1
-    submitter = Utils.get_submitter_details(ASSIGNMENT_URL, submission, groups_mode=GROUP_ASSIGNMENT)
-    if not submitter:
-        print('ERROR: submitter details not found for submission; skipping:', submission)
-        continue
-
-    if speedgrader_file:
-        speedgrader_link = Utils.course_url_to_speedgrader(args.url[0], submitter['canvas_user_id'])
-        if speedgrader_file.endswith('xlsx'):
-            speedgrader_link = '=hyperlink("%s")' % speedgrader_link
-        turnitin_link = get_turnitin_id(submission)
-        if turnitin_link:
-            turnitin_links_present = True
-            turnitin_link = 'https://api.turnitinuk.com/api/lti/1p0/redirect/dv/report/%s/instructor' % turnitin_link
-            if speedgrader_file.endswith('xlsx'):
-                turnitin_link = '=hyperlink("%s")' % turnitin_link
-        if GROUP_ASSIGNMENT:
-            speedgrader_output.append(
-                [submitter['group_name'], submitter['canvas_group_id'], speedgrader_link, turnitin_link])
-        else:
-            speedgrader_output.append(
-                [submitter['student_number'], submitter['student_name'], submitter['canvas_user_id'], speedgrader_link,
-                 turnitin_link])
-        continue
-
-    if turnitin_session_cookie:
-        turnitin_id = get_turnitin_id(submission)
-        if not turnitin_id:
-            print('WARNING: Turnitin PDF requested, but Turnitin information is missing for submission from', submitter)
-            continue
-
-        turnitin_pdf_generation_response = requests.post(
-            'https://ev.turnitinuk.com/paper/%s/queue_pdf?output=json' % turnitin_id,
-            data={'as': 1, 'or_type': 'similarity'}, headers=turnitin_session_cookie)
+def get_download_size(jobs):
+    """Canvas provides the size of each attachment, so we can work out the total size of a set of download jobs"""
+    return sum(job[0].get('size') or 0 for job in jobs)
+
+
+def queue_assignment_downloads(downloader, executor, progress, pending_downloads):
+    """Add a prepared SubmissionDownloader's attachments to the shared download queue (see download_all), after first
+    downloading any per-assignment files. Returns False (and queues nothing) if there is not enough disk space. We
+    start each assignment's largest files first so that one very large file (e.g., a video) does not leave the end of
+    the run using only a single connection"""
+    downloader.download_assignment_files()
+    jobs = sorted(downloader.download_jobs, key=lambda job: job[0].get('size') or 0, reverse=True)
+    if not jobs:
+        return True
+
+    total_bytes = get_download_size(jobs)
+    queued_bytes = max(progress.total_bytes - progress.transferred_bytes, 0)  # other assignments' remaining downloads
+    free_bytes = shutil.disk_usage(downloader.output_directory).free
+    if queued_bytes + total_bytes > free_bytes:
+        print('ERROR: downloading', len(jobs), 'submission attachments for assignment', downloader.assignment_id,
+              'requires', TransferProgress.format_bytes(total_bytes), '(plus',
+              TransferProgress.format_bytes(queued_bytes), 'already queued) but only',
+              TransferProgress.format_bytes(free_bytes), 'is available at', downloader.output_directory,
+              '- skipping this assignment')
+        return False
+
+    print('Downloading', len(jobs), 'submission attachments for assignment', downloader.assignment_id,
+          '(%s)' % TransferProgress.format_bytes(total_bytes))
+    progress.add_total(total_bytes, len(jobs))
+    for job in jobs:
+        pending_downloads[executor.submit(downloader.download_attachment, *job, progress)] = (downloader,) + job
+    return True
+
+
+def download_all(downloaders):
+    """Download everything found by several SubmissionDownloaders, with every assignment's attachments sharing one
+    download queue, so DOWNLOAD_MAX_WORKERS applies to all of them together. Each item of `downloaders` is either a
+    prepared SubmissionDownloader or a future that returns one (or None if the assignment could not be prepared). An
+    assignment's attachments join the queue as soon as its future completes, so downloads start while others are still
+    being prepared (see allsubmissions.py). Returns the list of downloaders whose attachments were downloaded"""
+    prepared_downloaders = [d for d in downloaders if not isinstance(d, concurrent.futures.Future)]
+    pending_preparations = set(d for d in downloaders if isinstance(d, concurrent.futures.Future))
+    progress = TransferProgress(0, 0)
+    start_time = time.monotonic()
+    failure_count = 0
+    attachment_hashes = {}
+    queued_downloaders = []
+
+    # if requested, archives are extracted in a separate process pool as soon as they arrive, overlapping with downloads
+    extraction_executor = None
+    if any(downloader.args.extract_archives for downloader in prepared_downloaders):
+        extraction_executor = concurrent.futures.ProcessPoolExecutor()
+        # with the "fork" start method (the default on Linux), the pool creates all of its worker processes at the
+        # first submission; doing this now, before any download threads exist, avoids forking a multi-threaded process
+        # (which can deadlock). The "spawn" method is not used because allsubmissions.py has no `__main__` guard
+        extraction_executor.submit(int).result()
+    pending_extractions = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=DOWNLOAD_MAX_WORKERS) as executor:
+        pending_downloads = {}  # future: (SubmissionDownloader, attachment, output path, submission, submitter)
+        for downloader in prepared_downloaders:
+            if queue_assignment_downloads(downloader, executor, progress, pending_downloads):
+                queued_downloaders.append(downloader)
+
+        while pending_downloads or pending_preparations:
+            completed, _ = concurrent.futures.wait(set(pending_downloads) | pending_preparations,
+                                                   timeout=PROGRESS_INTERVAL,
+                                                   return_when=concurrent.futures.FIRST_COMPLETED)
+            downloads_active = bool(pending_downloads)
+            for future in completed:
+                if future in pending_preparations:
+                    pending_preparations.remove(future)
+                    downloader = future.result()
+                    if downloader and queue_assignment_downloads(downloader, executor, progress, pending_downloads):
+                        queued_downloaders.append(downloader)
+                    continue
+
+                downloader, document, output_file_path, _, _ = pending_downloads.pop(future)
+                progress.add(completed_files=1)
+                downloader.download_time = time.monotonic() - start_time
+                if not future.result():
+                    failure_count += 1
+                    continue
+                attachment_hashes[output_file_path] = future.result()
+                downloader.downloaded_bytes += document.get('size') or 0
+                downloader.downloaded_files += 1
+                if downloader.args.extract_archives and output_file_path.lower().endswith('.zip'):
+                    extraction_arguments = (output_file_path, os.path.splitext(output_file_path)[0],
+                                            EXTRACT_MAX_TOTAL_BYTES, EXTRACT_MAX_FILES, EXTRACT_MAX_COMPRESSION_RATIO)
+                    if extraction_executor:
+                        extraction_future = extraction_executor.submit(Utils.extract_archive, *extraction_arguments)
+                        pending_extractions[extraction_future] = (downloader, output_file_path)
+                    else:
+                        # the pool is only created for assignments that are known before any threads have started
+                        success, message = Utils.extract_archive(*extraction_arguments)
+                        print('Extracted archive' if success else 'WARNING: unable to extract archive',
+                              downloader.get_relative_path(output_file_path), '-', message)
+            if downloads_active:  # (no need to repeat the same status while waiting for assignments to be prepared)
+                print('Download progress:', progress.status())
+            print_extraction_results(pending_extractions, timeout=0)
+    if failure_count > 0:
+        print('WARNING:', failure_count, 'attachment downloads failed - see above for details')
+
+    if extraction_executor:
+        if pending_extractions:
+            print('Waiting for', len(pending_extractions), 'archive extractions to finish')
+        print_extraction_results(pending_extractions)
+        extraction_executor.shutdown()
+
+    for downloader in queued_downloaders:
+        downloader.finish(attachment_hashes)
+    return queued_downloaders
+
+
+def print_extraction_results(pending_extractions, timeout=None):
+    """Report (and remove) any completed extractions from a dict of {future: (SubmissionDownloader, archive path)},
+    waiting up to `timeout` seconds (or indefinitely if None) for those that are still in progress"""
+    completed, _ = concurrent.futures.wait(pending_extractions, timeout=timeout)
+    for future in completed:
+        downloader, archive_path = pending_extractions.pop(future)
+        success, message = future.result()
+        print('Extracted archive' if success else 'WARNING: unable to extract archive',
+              downloader.get_relative_path(archive_path), '-', message)
+
+
+class SubmissionDownloader:
+    """Download the submissions for a single assignment, configured using the arguments from get_args. `prepare`
+    retrieves the submission list and works out which files are needed, then download_all retrieves them - passing
+    several downloaders (see allsubmissions.py) downloads every assignment's attachments in one queue. Passing
+    the assignment's details (if already known) and a shared requests session avoids repeating requests and
+    connections for each assignment"""
+
+    def __init__(self, args, assignment_details=None, session=None):
+        self.args = args
+        self.assignment_url = Utils.course_url_to_api(args.url[0])
+        self.assignment_id = Utils.get_assignment_id(self.assignment_url)  # used only for output directory
+        working_directory = os.path.dirname(
+            os.path.realpath(__file__)) if args.working_directory is None else args.working_directory
+        self.output_directory = '%s/%d' % (working_directory, self.assignment_id)
+        self.assignment_details = assignment_details
+        self.session = session if session else requests.Session()
+        self.group_assignment = False
+
+        self.submitter_matcher = None
+        if args.submitter_pattern:
+            self.submitter_matcher = re.compile(args.submitter_pattern, flags=re.IGNORECASE)
+        self.turnitin_session_cookie = None
+        if args.turnitin_pdf_session_id:
+            self.turnitin_session_cookie = {'cookie': 'session-id=%s' % args.turnitin_pdf_session_id}
+
+        self.download_jobs = []  # (attachment, output path, submission, submitter)
+        self.bulk_archive_entries = {}
+        self.turnitin_report_requests = []
+        self.index_records = []
+        self.existing_attachment_count = 0
+
+        # used to summarise where the time goes when downloading several assignments (see allsubmissions.py)
+        self.prepare_time = 0
+        self.download_time = 0  # from the start of the download queue until this assignment's last attachment arrives
+        self.downloaded_bytes = 0
+        self.downloaded_files = 0
+
+    def filter_matched_submissions(self, single_submission):
+        submitter_details = Utils.get_submitter_details(self.assignment_url, single_submission,
+                                                        groups_mode=self.group_assignment)
+        if self.group_assignment:
+            return self.submitter_matcher.match(submitter_details['group_name'])
+        return self.submitter_matcher.match(submitter_details['student_number']) or self.submitter_matcher.match(
+            submitter_details['student_name'])
+
+    def get_attachment_output_path(self, submission_output_directory, submitter, document):
+        if self.args.multiple_attachments:
+            return os.path.join(submission_output_directory, document['filename'])
+        return os.path.join(submission_output_directory, '%s.%s' % (
+            submitter['group_name' if self.group_assignment else 'student_number'],
+            document['filename'].split('.')[-1].lower()))
+
+    def get_relative_path(self, output_file_path):
+        return output_file_path.replace(self.output_directory, '')[1:]
+
+    def download_attachment(self, document, output_file_path, submission, submitter, progress):
+        """Stream a single attachment to disk, returning its SHA-256 hash (or None on failure). Files are written to a
+        temporary path and renamed once complete so that an interrupted download is never mistaken for an existing
+        one when resuming in `--all-attempts` mode"""
+        partial_file_path = '%s.part' % output_file_path
+        file_hash = hashlib.sha256()
+        downloaded_bytes = 0
+        try:
+            os.makedirs(os.path.dirname(output_file_path), exist_ok=True)
+            with self.session.get(document['url'], stream=True) as file_download_response:
+                if file_download_response.status_code != 200:
+                    print('ERROR: download failed for submission from', submitter, 'at', document['url'])
+                    return None
+                with open(partial_file_path, 'wb') as output_file:
+                    for chunk in file_download_response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        output_file.write(chunk)
+                        file_hash.update(chunk)
+                        progress.add(len(chunk))
+                        downloaded_bytes += len(chunk)
+            os.replace(partial_file_path, output_file_path)
+        except (requests.exceptions.RequestException, OSError) as e:  # OSError: e.g., disk full or permission denied
+            print('ERROR: download failed for submission from', submitter, 'at', document['url'], '-', e)
+            progress.add(-downloaded_bytes)  # only count bytes that were actually saved
+            if os.path.exists(partial_file_path):
+                os.remove(partial_file_path)
+            return None
+
+        late_status = ' (LATE: %d seconds)' % submission['seconds_late'] if submission['late'] else ''
+        print('Saved %s[truncated] as %d/%s%s' % (document['url'].split('download?')[0], self.assignment_id,
+                                                  self.get_relative_path(output_file_path), late_status))
+        return file_hash.hexdigest()
+
+    def get_index_record(self, submission, submitter):
+        """Create a `--metadata-index` entry for a submission; attachments are added via add_index_attachment"""
+        return {
+            'assignment_id': self.assignment_id,
+            'submission_id': submission['id'],
+            'canvas_user_id': submitter['canvas_user_id'],
+            'student_number': submitter.get('student_number'),
+            'student_name': submitter.get('student_name'),
+            'canvas_group_id': submitter.get('canvas_group_id'),
+            'group_name': submitter.get('group_name'),
+            'attempt': submission.get('attempt'),
+            'workflow_state': submission.get('workflow_state'),
+            'submitted_at': submission.get('submitted_at'),
+            'late': submission.get('late', False),
+            'seconds_late': submission.get('seconds_late', 0),
+            'turnitin_id': get_turnitin_id(submission) or None,
+            'speedgrader_url': Utils.course_url_to_speedgrader(self.args.url[0], submitter['canvas_user_id']),
+            'attachments': []
+        }
+
+    def add_index_attachment(self, index_record, document, output_file_path, attempt_number):
+        if index_record is None:
+            return
+        index_record['attachments'].append({
+            'attachment_id': document['id'],
+            'attempt': attempt_number,
+            'filename': document['filename'],
+            'content_type': document.get('content-type'),
+            'size': document.get('size'),
+            'path': os.path.relpath(output_file_path, self.output_directory),
+            'sha256': None  # set once the file has been saved
+        })
+
+    def write_metadata_index(self, attachment_hashes):
+        """Save all index records as JSON Lines (one submission per line). Hashes are taken from attachment_hashes where
+        the file was downloaded in this run, or calculated from the local copy otherwise (e.g., `--bulk-archive`
+        entries or attempts skipped because they already exist)"""
+        index_file_path = os.path.join(self.output_directory, METADATA_INDEX_FILE)
+        with open(index_file_path, 'w') as index_file:
+            for index_record in self.index_records:
+                for attachment in index_record['attachments']:
+                    attachment_path = os.path.join(self.output_directory, attachment['path'])
+                    if attachment_path in attachment_hashes:
+                        attachment['sha256'] = attachment_hashes[attachment_path]
+                    elif os.path.exists(attachment_path):
+                        attachment['sha256'] = Utils.get_file_sha256(attachment_path)
+                index_file.write(json.dumps(index_record) + '\n')
+        print('Saved metadata for', len(self.index_records), 'submissions to', index_file_path)
+
+    def download_bulk_archive(self):
+        """Request Canvas's own "download all submissions" zip file for the assignment, wait until it has been compiled,
+        then stream it to disk and rename its contents. Canvas names archive entries as [sanitised user name]_[LATE_]
+        [Canvas user ID]_[attachment ID]_[original filename], so the attachment ID is used to look up each entry's
+        output path in bulk_archive_entries (a dict of {attachment ID: (output path, submission)}). Returns False on
+        failure"""
+        archive_entries = self.bulk_archive_entries
+        archive_url = '%s/submissions' % self.args.url[0].rstrip('/')
+        archive_headers = Utils.canvas_api_headers()
+        delay_time = BULK_ARCHIVE_INITIAL_DELAY
+        while True:
+            # `compile=1` asks Canvas to (re)build the archive if needed; the response reports its current status
+            archive_status_response = requests.get(archive_url, params={'zip': 1, 'compile': 1},
+                                                   headers=archive_headers)
+            try:
+                archive_status = archive_status_response.json()['attachment']
+            except (ValueError, KeyError):
+                print('ERROR: unable to request submissions archive (status code %d) - note that this option '
+                      'requires an API token that Canvas accepts for non-API (web) requests' %
+                      archive_status_response.status_code)
+                return False
+
+            if archive_status['workflow_state'] == 'zipped':
+                break
+            if archive_status['workflow_state'] == 'errored':
+                print('ERROR: Canvas was unable to compile the submissions archive')
+                return False
+            print('Waiting for Canvas to compile submissions archive (%s%% complete; delaying %.1fs)' % (
+                archive_status.get('file_state', 0), delay_time))
+            time.sleep(delay_time)
+            delay_time = min(delay_time * 1.5, BULK_ARCHIVE_MAXIMUM_DELAY)
+
+        archive_path = os.path.join(self.output_directory, 'submissions-%d.zip' % self.assignment_id)
+        print('Downloading submissions archive', archive_status.get('readable_size', ''), 'to', archive_path)
+        try:
+            with self.session.get(archive_url, params={'zip': 1}, headers=archive_headers,
+                                  stream=True) as archive_response:
+                if archive_response.status_code != 200:
+                    print('ERROR: submissions archive download failed - status code', archive_response.status_code)
+                    return False
+                with open(archive_path, 'wb') as archive_file:
+                    for chunk in archive_response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        archive_file.write(chunk)
+            self.extract_bulk_archive(archive_path, archive_entries)
+        except (requests.exceptions.RequestException, zipfile.BadZipFile, OSError) as e:
+            print('ERROR: unable to download or extract submissions archive -', e)
+            return False
+        finally:
+            if os.path.exists(archive_path):
+                os.remove(archive_path)  # the archive is never kept, even after a failure part-way through
+
+        for output_file_path, _ in archive_entries.values():
+            print('ERROR: no entry found in submissions archive for', self.get_relative_path(output_file_path),
+                  '- please download this attachment individually')
+        return True
+
+    def extract_bulk_archive(self, archive_path, archive_entries):
+        """Rename (and remove from archive_entries) each submissions archive entry that matches an expected attachment;
+        see download_bulk_archive. Zip attachments are also extracted in `--extract-archives` mode. Raises
+        zipfile.BadZipFile or OSError if the submissions archive cannot be read or saved"""
+        entry_matcher = re.compile(r'_(?P<user>\d+)_(?P<attachment>\d+)_')
+        extracted_count = 0
+        with zipfile.ZipFile(archive_path) as archive:
+            for entry in archive.infolist():
+                entry_match = entry_matcher.search(os.path.basename(entry.filename))
+                if entry.is_dir() or not entry_match:
+                    print('WARNING: skipping unrecognised submissions archive entry', entry.filename)
+                    continue
+
+                attachment_id = int(entry_match.group('attachment'))
+                if attachment_id not in archive_entries:
+                    continue  # filtered submitters, superseded attachments and group duplicates are all skipped here
+
+                output_file_path, submission = archive_entries[attachment_id]
+                partial_file_path = '%s.part' % output_file_path  # as in download_attachment
+                try:
+                    with archive.open(entry) as entry_file, open(partial_file_path, 'wb') as output_file:
+                        shutil.copyfileobj(entry_file, output_file, DOWNLOAD_CHUNK_SIZE)
+                    os.replace(partial_file_path, output_file_path)
+                finally:
+                    if os.path.exists(partial_file_path):
+                        os.remove(partial_file_path)
+                del archive_entries[attachment_id]
+                extracted_count += 1
+                late_status = ' (LATE: %d seconds)' % submission['seconds_late'] if submission['late'] else ''
+                print('Saved archive entry %s as %s (%d of %d)%s' % (
+                    entry.filename, self.get_relative_path(output_file_path), extracted_count,
+                    extracted_count + len(archive_entries), late_status))
+
+                if self.args.extract_archives and output_file_path.lower().endswith('.zip'):
+                    success, message = Utils.extract_archive(
+                        output_file_path, os.path.splitext(output_file_path)[0], EXTRACT_MAX_TOTAL_BYTES,
+                        EXTRACT_MAX_FILES, EXTRACT_MAX_COMPRESSION_RATIO)
+                    print('Extracted archive' if success else 'WARNING: unable to extract archive',
+                          self.get_relative_path(output_file_path), '-', message)
+
+    def queue_turnitin_report(self, turnitin_id, submitter):
+        """Request generation of a Turnitin similarity report PDF, returning a tuple of (report status URL, output file
+        identifier), or None if the request failed"""
+        try:
+            turnitin_pdf_generation_response = requests.post(
+                'https://ev.turnitinuk.com/paper/%s/queue_pdf?output=json' % turnitin_id,
+                data={'as': 1, 'or_type': 'similarity'}, headers=self.turnitin_session_cookie)
+        except requests.exceptions.RequestException as e:
+            print('WARNING: Turnitin PDF generation request failed for submission from', submitter, '-', e)
+            return None
 
         if turnitin_pdf_generation_response.status_code == 202:
             turnitin_report_url = turnitin_pdf_generation_response.json()['url']
-            turnitin_report_downloads['%s&output=json' % turnitin_report_url] = submitter[
-                'group_name' if GROUP_ASSIGNMENT else 'student_number']  # we need the ID for saving, later
             print('Queuing Turnitin PDF download from %s[truncated]' % turnitin_report_url.split('queue_pdf')[0])
+            output_identifier = submitter['group_name' if self.group_assignment else 'student_number']
+            return '%s&output=json' % turnitin_report_url, output_identifier
+
+        print('WARNING: Turnitin PDF generation failed for submission from', submitter,
+              '- please refresh the Turnitin session ID (see `python submissiondownloader.py --help`)')
+        return None
+
+    def save_turnitin_report(self, download_url, output_identifier):
+        file_download_response = requests.get(download_url, headers=self.turnitin_session_cookie)
+        if file_download_response.status_code != 200:
+            print('ERROR: Turnitin PDF download failed for submission from', output_identifier, 'at', download_url)
+            return False
+
+        output_filename = '%s.pdf' % output_identifier
+        with open(os.path.join(self.output_directory, output_filename), 'wb') as output_file:
+            output_file.write(file_download_response.content)
+        print('Saved Turnitin PDF %s[truncated]' % download_url.split('queue_pdf')[0], 'as', output_filename)
+        return True
+
+    def download_turnitin_reports(self, report_downloads):
+        """Poll queued Turnitin reports until they are ready, then download them. Each report is polled on its own
+        timer, backing off independently while it is not ready, and reports are downloaded concurrently as soon as they
+        become available. The report_downloads parameter is a dict of {report status URL: output file identifier}"""
+        print('Downloading', len(report_downloads), 'queued Turnitin report PDFs')
+        download_count = 0
+        failure_count = 0
+        download_total = len(report_downloads)
+
+        # a min-heap of (next poll time, report status URL, current delay, status checks so far) that schedules each
+        # report individually
+        poll_schedule = [(time.monotonic(), report_url, TURNITIN_INITIAL_DELAY, 0) for report_url in report_downloads]
+        heapq.heapify(poll_schedule)
+        in_progress = {}  # future: (task type, report status URL, current delay, status checks so far)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=TURNITIN_MAX_WORKERS) as executor:
+            while poll_schedule or in_progress:
+                current_time = time.monotonic()
+                while poll_schedule and poll_schedule[0][0] <= current_time:
+                    _, report_url, delay_time, check_count = heapq.heappop(poll_schedule)
+                    poll_future = executor.submit(requests.get, report_url, headers=self.turnitin_session_cookie)
+                    in_progress[poll_future] = ('poll', report_url, delay_time, check_count + 1)
+
+                # sleep until either a request completes or the next report is due to be polled
+                wait_time = max(0.0, poll_schedule[0][0] - current_time) if poll_schedule else None
+                if not in_progress:
+                    time.sleep(wait_time)  # wait() returns immediately when given no futures
+                    continue
+                completed, _ = concurrent.futures.wait(in_progress, timeout=wait_time,
+                                                       return_when=concurrent.futures.FIRST_COMPLETED)
+
+                for future in completed:
+                    task_type, report_url, delay_time, check_count = in_progress.pop(future)
+                    if task_type == 'download':
+                        try:
+                            downloaded = future.result()
+                        except (requests.exceptions.RequestException, OSError) as e:
+                            print('ERROR: Turnitin PDF download failed for submission from',
+                                  report_downloads[report_url], '-', e)
+                            downloaded = False
+                        if downloaded:
+                            download_count += 1
+                        else:
+                            failure_count += 1
+                        print('Processed Turnitin PDF', download_count + failure_count, 'of', download_total)
+                        continue
+
+                    try:
+                        download_result_json = future.result().json()
+                    except (requests.exceptions.RequestException, ValueError) as e:
+                        download_result_json = {}
+                        print('WARNING: unable to check Turnitin report status for', report_downloads[report_url],
+                              '-', e)
+
+                    if download_result_json.get('ready') and download_result_json.get('url'):
+                        print('Turnitin report for', report_downloads[report_url], 'is ready; starting download')
+                        download_future = executor.submit(self.save_turnitin_report, download_result_json['url'],
+                                                          report_downloads[report_url])
+                        in_progress[download_future] = ('download', report_url, delay_time, check_count)
+                    elif check_count >= TURNITIN_MAXIMUM_CHECKS:
+                        print('ERROR: Turnitin report for', report_downloads[report_url], 'was not ready after',
+                              check_count, 'status checks - giving up')
+                        failure_count += 1
+                    else:
+                        delay_time = min(delay_time * 1.5, TURNITIN_MAXIMUM_DELAY)
+                        heapq.heappush(poll_schedule, (time.monotonic() + delay_time, report_url, delay_time,
+                                                       check_count))
+
+        print('Downloaded', download_count, 'of', download_total, 'Turnitin report PDFs')
+        if failure_count > 0:
+            print('WARNING:', failure_count, 'Turnitin report PDFs could not be downloaded - see above for details')
+
+    def prepare(self, submission_list_json=None):
+        """Retrieve the assignment's submissions and work out what needs to be downloaded (or, in `--speedgrader-file`
+        mode, save the roster file). If the submission list has already been retrieved (e.g., as part of a course-wide
+        request), it can be passed as submission_list_json. Returns False if the assignment cannot be processed"""
+        start_time = time.monotonic()
+        if os.path.exists(self.output_directory) and not self.args.all_attempts:
+            print('ERROR: assignment output directory', self.output_directory, 'already exists - please remove or',
+                  'rename')
+            return False
+        os.makedirs(self.output_directory, exist_ok=True)
+
+        if not self.assignment_details:
+            assignment_details_response = requests.get(self.assignment_url, headers=Utils.canvas_api_headers())
+            if assignment_details_response.status_code != 200:
+                print('ERROR: unable to get assignment details - did you set a valid Canvas API token in %s?' %
+                      Config.FILE_PATH)
+                return False
+            self.assignment_details = assignment_details_response.json()
+        self.group_assignment = True if self.assignment_details['group_category_id'] else False
+        print('Retrieved assignment details - group assignment:', self.group_assignment)
+
+        speedgrader_file = None
+        if self.args.speedgrader_file and self.args.speedgrader_file.lower() in ['xlsx', 'csv']:
+            speedgrader_file = '%s/speedgrader.%s' % (self.output_directory, self.args.speedgrader_file.lower())
+            print('Creating a course roster file with SpeedGrader links from', self.args.url[0], 'at',
+                  speedgrader_file)
         else:
-            print('WARNING: Turnitin PDF generation failed for submission from', submitter,
-                  '- please refresh the Turnitin session ID (see `python submissiondownloader.py --help`)')
-        continue
-
-    if 'attachments' in submission:
-        submission_output_directory = OUTPUT_DIRECTORY
-        if args.multiple_attachments:
-            submission_output_directory = os.path.join(
-                OUTPUT_DIRECTORY, submitter['group_name' if GROUP_ASSIGNMENT else 'student_number'])
-            if os.path.exists(submission_output_directory):
-                print('ERROR: output directory', submission_output_directory,
-                      'already exists - please remove or rename the root assignment output folder')
-                sys.exit()
-            os.mkdir(submission_output_directory)
-
-        submission_documents = submission['attachments']
-        submission_documents.sort(key=functools.cmp_to_key(compare_attachment_dates))  # newest attachment is now first
-        for document in submission_documents:
-            file_download_response = requests.get(document['url'])
-            if file_download_response.status_code == 200:
-                if args.multiple_attachments:
-                    output_file_path = os.path.join(submission_output_directory, document['filename'])
-                else:
-                    output_file_path = os.path.join(submission_output_directory, '%s.%s' % (
-                        submitter['group_name' if GROUP_ASSIGNMENT else 'student_number'],
-                        document['filename'].split('.')[-1].lower()))
-
-                with open(output_file_path, 'wb') as output_file:
-                    output_file.write(file_download_response.content)
-                late_status = ' (LATE: %d seconds)' % submission['seconds_late'] if submission['late'] else ''
-                print('Saved %s[truncated] as %s (%d of %d)%s' % (document['url'].split('download?')[0],
-                                                                  output_file_path.replace(OUTPUT_DIRECTORY, '')[1:],
-                                                                  download_count, download_total, late_status))
-
+            output_format = '[student number].[uploaded file extension]'
+            if self.group_assignment:
+                output_format = '[group name].[uploaded file extension]'
+            if self.args.multiple_attachments:
+                output_format = '[group name]/[original uploaded filename]'
+            if self.args.all_attempts:
+                output_format = '[group name]/[attempt number]/[original uploaded filename]'
+            print('Downloading all submission documents from', self.args.url[0], 'named as', output_format, 'to',
+                  self.output_directory)
+
+        if submission_list_json is None:
+            submission_list_response = Utils.get_assignment_submissions(
+                self.assignment_url, includes=['submission_history'] if self.args.all_attempts else None)
+            if not submission_list_response:
+                print('ERROR: unable to retrieve submission list - did you set a valid Canvas API token in %s?' %
+                      Config.FILE_PATH)
+                return False
+            submission_list_json = json.loads(submission_list_response)
+
+        filtered_submission_list = Utils.filter_assignment_submissions(self.assignment_url, submission_list_json,
+                                                                       groups_mode=self.group_assignment,
+                                                                       sort_entries=True)
+
+        if self.submitter_matcher:
+            matched_submissions = list(filter(self.filter_matched_submissions, filtered_submission_list))
+            print('Filtered', len(filtered_submission_list), 'valid submissions using pattern',
+                  '"%s"' % self.args.submitter_pattern, '-', len(matched_submissions), 'valid submissions remaining')
+            filtered_submission_list = matched_submissions
+
+        speedgrader_writer = None
+        turnitin_links_present = False
+        if speedgrader_file:
+            if self.group_assignment:
+                spreadsheet_headers = ['Group name', 'Canvas group ID', 'Speedgrader link']
             else:
-                print('ERROR: download failed for submission from', submitter, 'at', document['url'], '- aborting')
-                break  # TODO: try next attachment instead? (if one exists)
-
-            if len(submission_documents) > 1 and not args.multiple_attachments:
-                print('WARNING: ignoring all attachments after the newest item for submission from', submitter,
-                      '- did you mean to enable --multiple-attachments mode?')
-                break
-    else:
-        print('ERROR: unable to locate attachment for submission from', submitter, '- skipping')
-
-if speedgrader_file:
-    if GROUP_ASSIGNMENT:
-        spreadsheet_headers = ['Group name', 'Canvas group ID', 'Speedgrader link']
-    else:
-        spreadsheet_headers = ['Student number', 'Student name', 'Canvas user ID', 'Speedgrader link']
-    if turnitin_links_present:
-        spreadsheet_headers.append(
-            'Turnitin report link (note if these links do not work, visit %s first then retry)' % args.url[0])
-
-    if speedgrader_file.endswith('xlsx'):
-        workbook = openpyxl.Workbook()
-        spreadsheet = workbook.active
-        spreadsheet.title = 'Course roster (%d)' % ASSIGNMENT_ID
-        spreadsheet.freeze_panes = 'A2'  # set the first row as a header
-        spreadsheet.append(spreadsheet_headers)
-        for row in speedgrader_output:
-            spreadsheet.append(row)
-        workbook.save(speedgrader_file)
-
-    elif speedgrader_file.endswith('csv'):
-        with open(speedgrader_file, 'w', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow(spreadsheet_headers)
-            writer.writerows(speedgrader_output)
-
-if args.turnitin_pdf_session_id:
-    print('Downloading queued Turnitin report PDFs')
-    download_count = 0
-    download_total = len(turnitin_report_downloads)
-    downloads_remaining = download_total
-    delay_time = 0.5
-    while downloads_remaining > 0:
-        # queue all requests concurrently
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            responses = [executor.submit(requests.get, report, headers=turnitin_session_cookie) for report
-                         in turnitin_report_downloads.keys()]
-            concurrent.futures.wait(responses)
-
-        # check each response's readiness, downloading and removing completed requests
-        for response in responses:
-            request_url = response.result().url
-            download_result_json = response.result().json()
-
-            if download_result_json['ready']:
-                download_count += 1
-                download_url = download_result_json['url']
-                file_download_response = requests.get(download_url, headers=turnitin_session_cookie)
-                if file_download_response.status_code == 200:
-                    output_filename = '%s.pdf' % turnitin_report_downloads[request_url]
-                    with open(os.path.join(OUTPUT_DIRECTORY, output_filename), 'wb') as output_file:
-                        output_file.write(file_download_response.content)
-                    print('Saved Turnitin PDF %s[truncated]' % download_url.split('queue_pdf')[0], 'as',
-                          output_filename, '(%d of %d)' % (download_count, download_total))
-
+                spreadsheet_headers = ['Student number', 'Student name', 'Canvas user ID', 'Speedgrader link']
+            turnitin_links_present = any(get_turnitin_id(submission) for submission in filtered_submission_list)
+            if turnitin_links_present:
+                spreadsheet_headers.append(
+                    'Turnitin report link (note if these links do not work, visit %s first then retry)' %
+                    self.args.url[0])
+            speedgrader_writer = SpreadsheetWriter(speedgrader_file, spreadsheet_headers,
+                                                   title='Course roster (%d)' % self.assignment_id)
+
+        for submission in filtered_submission_list:
+            submitter = Utils.get_submitter_details(self.assignment_url, submission, groups_mode=self.group_assignment)
+            if not submitter:
+                print('ERROR: submitter details not found for submission; skipping:', submission)
+                continue
+
+            index_record = None
+            if self.args.metadata_index:
+                index_record = self.get_index_record(submission, submitter)
+                self.index_records.append(index_record)
+
+            if speedgrader_file:
+                speedgrader_link = Utils.course_url_to_speedgrader(self.args.url[0], submitter['canvas_user_id'])
+                if speedgrader_file.endswith('xlsx'):
+                    speedgrader_link = '=hyperlink("%s")' % speedgrader_link
+                turnitin_link = get_turnitin_id(submission)
+                if turnitin_link:
+                    turnitin_link = 'https://api.turnitinuk.com/api/lti/1p0/redirect/dv/report/%s/instructor' % (
+                        turnitin_link)
+                    if speedgrader_file.endswith('xlsx'):
+                        turnitin_link = '=hyperlink("%s")' % turnitin_link
+                if self.group_assignment:
+                    speedgrader_row = [submitter['group_name'], submitter['canvas_group_id'], speedgrader_link]
                 else:
-                    print('ERROR: Turnitin PDF download failed for submission from',
-                          turnitin_report_downloads[request_url], 'at', download_url, '- aborting')
-
-                del turnitin_report_downloads[request_url]
-
-        downloads_remaining = len(turnitin_report_downloads)
-        if downloads_remaining > 0:
-            delay_time *= 1.5
-            print('Waiting for', downloads_remaining, 'Turnitin report(s) not yet ready (delaying %.1fs)' % delay_time)
-            time.sleep(delay_time)
+                    speedgrader_row = [submitter['student_number'], submitter['student_name'],
+                                       submitter['canvas_user_id'], speedgrader_link]
+                if turnitin_links_present:
+                    speedgrader_row.append(turnitin_link)
+                speedgrader_writer.append(speedgrader_row)
+                continue
+
+            if self.turnitin_session_cookie:
+                turnitin_id = get_turnitin_id(submission)
+                if not turnitin_id:
+                    print('WARNING: Turnitin PDF requested, but Turnitin information is missing for submission from',
+                          submitter)
+                    continue
+                self.turnitin_report_requests.append((turnitin_id, submitter))
+                continue
+
+            submitter_identifier = submitter['group_name' if self.group_assignment else 'student_number']
+            if self.args.all_attempts:
+                # each attempt is saved as [identifier]/[attempt number]/[filename]; any already downloaded are skipped
+                for attempt in submission.get('submission_history', []):
+                    if not attempt.get('attempt'):
+                        continue  # unsubmitted placeholder entries have no attempt number (or attachments)
+                    attempt_output_directory = os.path.join(self.output_directory, submitter_identifier,
+                                                            str(attempt['attempt']))
+                    for document in attempt.get('attachments', []):
+                        output_file_path = os.path.join(attempt_output_directory, document['filename'])
+                        self.add_index_attachment(index_record, document, output_file_path, attempt['attempt'])
+                        if os.path.exists(output_file_path) and os.path.getsize(output_file_path) == document['size']:
+                            self.existing_attachment_count += 1
+                            continue
+                        self.download_jobs.append((document, output_file_path, submission, submitter))
+                continue
+
+            if 'attachments' in submission:
+                submission_output_directory = self.output_directory
+                if self.args.multiple_attachments:
+                    submission_output_directory = os.path.join(self.output_directory, submitter_identifier)
+                    if os.path.exists(submission_output_directory):
+                        print('ERROR: output directory', submission_output_directory,
+                              'already exists - please remove or rename the root assignment output folder')
+                        return False
+                    os.mkdir(submission_output_directory)
+
+                submission_documents = submission['attachments']
+                # sort so that the newest attachment is first
+                submission_documents.sort(key=functools.cmp_to_key(compare_attachment_dates))
+                if len(submission_documents) > 1 and not self.args.multiple_attachments:
+                    print('WARNING: ignoring all attachments after the newest item for submission from', submitter,
+                          '- did you mean to enable --multiple-attachments mode?')
+                    submission_documents = submission_documents[:1]
+
+                for document in submission_documents:
+                    output_file_path = self.get_attachment_output_path(submission_output_directory, submitter,
+                                                                       document)
+                    self.add_index_attachment(index_record, document, output_file_path, submission.get('attempt'))
+                    if self.args.bulk_archive:
+                        # in archive mode we only record where each attachment should be saved; the files come later
+                        self.bulk_archive_entries[document['id']] = (output_file_path, submission)
+                    else:
+                        self.download_jobs.append((document, output_file_path, submission, submitter))
+            else:
+                print('ERROR: unable to locate attachment for submission from', submitter, '- skipping')
+
+        if speedgrader_writer:
+            speedgrader_writer.close()
+            print('Saved', speedgrader_writer.row_count, 'course roster entries to', speedgrader_file)
+        self.prepare_time = time.monotonic() - start_time
+        return True
+
+    def download_assignment_files(self):
+        """Download the files that are requested per assignment rather than per attachment: Turnitin report PDFs in
+        `--turnitin-pdf-session-id` mode, or Canvas's submissions archive in `--bulk-archive` mode"""
+        if self.args.turnitin_pdf_session_id:
+            # all PDF generation requests are independent, so we queue them concurrently before polling for the results
+            print('Queuing', len(self.turnitin_report_requests), 'Turnitin report PDFs')
+            with concurrent.futures.ThreadPoolExecutor(max_workers=TURNITIN_MAX_WORKERS) as executor:
+                queued_reports = list(executor.map(lambda r: self.queue_turnitin_report(*r),
+                                                   self.turnitin_report_requests))
+            self.download_turnitin_reports(dict(report for report in queued_reports if report))
+
+        elif self.args.bulk_archive and self.bulk_archive_entries:
+            self.download_bulk_archive()
+
+    def finish(self, attachment_hashes):
+        """Report skipped attachments and, if requested, save the metadata index once all attachments are downloaded"""
+        if self.existing_attachment_count > 0:
+            print('Skipped', self.existing_attachment_count,
+                  'submission attempt attachments that have already been downloaded for assignment', self.assignment_id)
+        if self.args.metadata_index:
+            self.write_metadata_index(attachment_hashes)
+
+
+if __name__ == '__main__':
+    submission_downloader = SubmissionDownloader(Args.interactive(get_args))
+    if submission_downloader.prepare():
+        download_all([submission_downloader])
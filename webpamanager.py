@@ -31,7 +31,7 @@ Example usage:
 __author__ = 'Simon Robinson'
 __copyright__ = 'Copyright (c) 2024 Simon Robinson'
 __license__ = 'Apache 2.0'
-__version__ = '2024-05-13'  # ISO 8601 (YYYY-MM-DD)
+__version__ = '2026-10-19'  # ISO 8601 (YYYY-MM-DD)
 
 import argparse
 import contextlib
@@ -53,7 +53,7 @@ import pandas  # we don't list Pandas in requirements.txt to skip installing for
 import requests
 import requests.structures
 
-from canvashelpers import Args, Utils, Config
+from canvashelpers import Args, Utils, Config, SpreadsheetWriter
 
 TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%SZ'  # e.g., '2024-12-31T13:30:00'
 
@@ -233,12 +233,12 @@ class GroupResponseProcessor:
         # the quiz can be customised in the canvashelpers.config file
         config_settings = Config.get_settings()
 
-        # for ease, we build the quiz link list every time, and just don't save it if not required
-        quiz_link_workbook = openpyxl.Workbook()
-        quiz_link_workbook_sheet = quiz_link_workbook.active
-        quiz_link_workbook_sheet.title = 'WebPA quiz links'
-        quiz_link_workbook_sheet.freeze_panes = 'A2'  # set the first row as a header
-        quiz_link_workbook_sheet.append(['Group name', 'Quiz link'])
+        # quiz links are streamed to their spreadsheet as each quiz is configured (only if they are to be saved)
+        quiz_link_file = os.path.join(WORKING_DIRECTORY, '%s.xlsx' % args.quiz_group_name)
+        quiz_link_spreadsheet = None
+        if args.setup_quiz_export_links and not args.dry_run:
+            quiz_link_spreadsheet = SpreadsheetWriter(quiz_link_file, ['Group name', 'Quiz link'],
+                                                      title='WebPA quiz links')
 
         output_count = 0
         for group_key in sorted(groups):
@@ -366,17 +366,15 @@ class GroupResponseProcessor:
 
             if not args.dry_run:
                 quiz_link = '%s/quizzes/%s' % (COURSE_URL.replace('/api/v1', ''), current_quiz_id)
-                quiz_link_workbook_sheet.append([groups[group_key][0]['group_name'], quiz_link])
                 print('\tFinished configuring quiz at', quiz_link)
-                if args.setup_quiz_export_links:
-                    pass
+                if quiz_link_spreadsheet:
+                    quiz_link_spreadsheet.append([groups[group_key][0]['group_name'], quiz_link])
             output_count += 1
 
         if args.setup_quiz_export_links:
-            quiz_link_file = os.path.join(WORKING_DIRECTORY, '%s.xlsx' % args.quiz_group_name)
             print('%s quiz links to' % ('DRY RUN: skipping saving' if args.dry_run else 'Saving'), quiz_link_file)
-            if not args.dry_run:
-                quiz_link_workbook.save(quiz_link_file)
+            if quiz_link_spreadsheet:
+                quiz_link_spreadsheet.close()
 
         print('Finished processing', output_count, 'groups')
         return
@@ -386,12 +384,12 @@ class GroupResponseProcessor:
         # the quiz can be customised in the canvashelpers.config file
         config_settings = Config.get_settings()
 
-        # for ease, we build the quiz link list every time, and just don't save it if not required
-        quiz_link_workbook = openpyxl.Workbook()
-        quiz_link_workbook_sheet = quiz_link_workbook.active
-        quiz_link_workbook_sheet.title = 'WebPA new quiz links'
-        quiz_link_workbook_sheet.freeze_panes = 'A2'  # set the first row as a header
-        quiz_link_workbook_sheet.append(['Group name', 'New quiz link'])
+        # quiz links are streamed to their spreadsheet as each quiz is configured (only if they are to be saved)
+        quiz_link_file = os.path.join(WORKING_DIRECTORY, '%s.xlsx' % args.quiz_group_name)
+        quiz_link_spreadsheet = None
+        if args.setup_quiz_export_links and not args.dry_run:
+            quiz_link_spreadsheet = SpreadsheetWriter(quiz_link_file, ['Group name', 'New quiz link'],
+                                                      title='WebPA new quiz links')
 
         output_count = 0
         for group_key in sorted(groups):
@@ -527,17 +525,15 @@ class GroupResponseProcessor:
 
             if not args.dry_run:
                 quiz_link = '%s/assignments/%s' % (COURSE_URL.replace('/api/v1', ''), current_quiz_id)
-                quiz_link_workbook_sheet.append([groups[group_key][0]['group_name'], quiz_link])
                 print('\tFinished configuring new quiz at', quiz_link)
-                if args.setup_quiz_export_links:
-                    pass
+                if quiz_link_spreadsheet:
+                    quiz_link_spreadsheet.append([groups[group_key][0]['group_name'], quiz_link])
             output_count += 1
 
         if args.setup_quiz_export_links:
-            quiz_link_file = os.path.join(WORKING_DIRECTORY, '%s.xlsx' % args.quiz_group_name)
             print('%s new quiz links to' % ('DRY RUN: skipping saving' if args.dry_run else 'Saving'), quiz_link_file)
-            if not args.dry_run:
-                quiz_link_workbook.save(quiz_link_file)
+            if quiz_link_spreadsheet:
+                quiz_link_spreadsheet.close()
 
         print('Finished processing', output_count, 'groups')
         return
@@ -1240,11 +1236,9 @@ if args.marks_file:
         sys.exit()
 
 # next, load responses and create a master spreadsheet containing all rater responses (for, e.g., manual verification)
-response_summary_workbook = openpyxl.Workbook()
-response_summary_sheet = response_summary_workbook.active
-response_summary_sheet.title = 'WebPA response form summary'
-response_summary_sheet.freeze_panes = 'A2'  # set the first row as a header
-response_summary_sheet.append(['Rater', 'Subject', 'Rating', 'Normalised', 'Group'])
+response_summary_file = os.path.join(WORKING_DIRECTORY, 'webpa-response-summary.xlsx')
+response_summary_sheet = SpreadsheetWriter(response_summary_file, ['Rater', 'Subject', 'Rating', 'Normalised', 'Group'],
+                                           title='WebPA response form summary')
 
 submission_students = [member['student_number'] for group_key in group_sets.values() for member in group_key]
 if args.quiz_group_name:
@@ -1258,8 +1252,7 @@ if len(respondent_list) <= 0:
     print('\nERROR: unable to continue; no valid WebPA responses to analyse')
     sys.exit()
 
-response_summary_file = os.path.join(WORKING_DIRECTORY, 'webpa-response-summary.xlsx')
-response_summary_workbook.save(response_summary_file)
+response_summary_sheet.close()
 print('\nProcessed', len(respondent_list), 'valid submissions of', len(respondent_list) + len(skipped_respondents),
       'total', '(%.1f%% of %d expected);' % (len(respondent_list) / len(submission_students), len(submission_students)),
       'combined responses saved to', response_summary_file)